@@ -60,7 +60,11 @@ if __name__ == '__main__':
     metadata.author_last = author_last
     metadata.year = datetime.date.today().year
 
-    in_file = selfpub.inp.Cleaner(metadata, selfpub.inp.ODTInputFile(inp, None))
+    if inp.lower().endswith(".fodt"):
+        in_file = selfpub.inp.FlatODTInputFile(inp, None)
+    else:
+        in_file = selfpub.inp.ODTInputFile(inp, None)
+    in_file = selfpub.inp.Cleaner(metadata, in_file)
     out_file = selfpub.outp.HtmlOutput(out, os.path.split(out)[0] or ".")
     style = ExampleStyleSheet()
 
@@ -1,2 +1,2 @@
 
-from . import inp, outp, text, stylesheet, convert
+from . import inp, outp, text, stylesheet, convert, arena
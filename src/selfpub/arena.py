@@ -0,0 +1,478 @@
+"""
+A compact, column-based store for a whole document.
+"""
+
+import array
+import itertools
+from . import text
+
+
+# Node kinds, as stored in the `kinds` column.
+NODE_CHAPTER = 1
+NODE_SIDEBAR = 2
+NODE_PARA = 3
+NODE_SEPARATOR = 4
+NODE_TEXT = 5
+NODE_SPECIAL = 6
+NODE_SPECIAL_WHITESPACE = 7
+NODE_CORRECTION = 8
+NODE_MEDIA = 9
+DIV_NODES = (NODE_CHAPTER, NODE_SIDEBAR, NODE_PARA, NODE_SEPARATOR)
+# The divs whose extra value is their source.
+SOURCE_NODES = (NODE_SIDEBAR, NODE_PARA, NODE_SEPARATOR)
+SPAN_NODES = (NODE_TEXT, NODE_SPECIAL, NODE_SPECIAL_WHITESPACE, NODE_CORRECTION, NODE_MEDIA)
+
+# The parent of the top-level nodes.
+NO_PARENT = 0xFFFFFFFF
+
+# A None field of a source.
+NO_VALUE = 0xFFFFFFFF
+
+
+class DocumentArena(object):
+    """
+    The sections of a document, stored as columns rather than objects.  The
+    text of all the spans is in one string, and each node (chapter,
+    paragraph, span, ...) is a row in these array('I') columns:
+
+        offsets, lengths: where the node's text is in the string.  The
+            nodes are stored in document order, so the text of a div is
+            the text of its children, one after the other.
+        style_ids: index of the node's style in `styles`.
+        kinds: NODE_* kind.
+        parents: index of the parent node, or NO_PARENT.
+        ends: index after the node's last descendant.
+        extra_ids: index in `extras` of the kind-specific value of the
+            node (see get_extra()), or 0 for none.  For the divs in
+            SOURCE_NODES, the row of the node's source instead.
+
+    The sources (text.Provenance) of the divs are rows of the columns
+    source_paragraphs, source_lines and source_offsets (NO_VALUE for
+    None), and source_names (index in `extras` of the style name); row 0
+    is for no source.  Spans' sources are not stored (see get_source()).
+
+    The styles, and the extra values that are strings, are only stored
+    once each.
+
+    Walking the columns (get_kind(), get_text(), get_children(), ...) is
+    the fast way to go through the document.  view() and sections() give
+    read-only text.Chapter, text.Para, text.Text, ... objects over the
+    arena, for code such as the outputs that expect the object tree.
+    Media nodes give the original text.Media object.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.offsets = array.array('I')
+        self.lengths = array.array('I')
+        self.style_ids = array.array('I')
+        self.kinds = array.array('I')
+        self.parents = array.array('I')
+        self.ends = array.array('I')
+        self.extra_ids = array.array('I')
+        self.source_paragraphs = array.array('I', (NO_VALUE,))
+        self.source_lines = array.array('I', (NO_VALUE,))
+        self.source_offsets = array.array('I', (NO_VALUE,))
+        self.source_names = array.array('I', (0,))
+        self.styles = []
+        self.extras = [None]
+        self.__style_ids = {}
+        self.__extra_ids = {}
+        self.__pieces = []
+        self.__size = 0
+        self.__text = ""
+
+    @property
+    def text(self):
+        """All the text, as one string."""
+        if len(self.__pieces) > 0:
+            self.__pieces.insert(0, self.__text)
+            self.__text = "".join(self.__pieces)
+            self.__pieces = []
+        return self.__text
+
+    def add_section(self, section):
+        """Store the section and everything in it, and return the index of
+        its node."""
+        return self.__add(section, NO_PARENT)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def get_kind(self, node):
+        return self.kinds[node]
+
+    def get_text(self, node):
+        offset = self.offsets[node]
+        return self.text[offset:offset + self.lengths[node]]
+
+    def get_style(self, node):
+        return self.styles[self.style_ids[node]]
+
+    def get_parent(self, node):
+        """The index of the parent node, or None for a top-level node."""
+        ret = self.parents[node]
+        if ret == NO_PARENT:
+            return None
+        return ret
+
+    def get_children(self, node):
+        """The indexes of the node's children."""
+        ret = []
+        end = self.ends[node]
+        child = node + 1
+        while child < end:
+            ret.append(child)
+            child = self.ends[child]
+        return ret
+
+    def get_extra(self, node):
+        """The kind-specific value for the node: the (name, index) of a
+        chapter, the html of a special character, the original text of a
+        correction, the text.Media object, or the source of a div."""
+        if self.kinds[node] in SOURCE_NODES:
+            return self.get_source(node)
+        return self.extras[self.extra_ids[node]]
+
+    def get_source(self, node):
+        """
+        The source of the node.  Only the divs' sources are stored; a span
+        has the source of its div, with its own style name.  (This is what
+        the parser gives the spans, but not always what the Cleaner does:
+        the spans of paragraphs it remembers are shared.)
+        """
+        div = node
+        while self.kinds[div] not in DIV_NODES:
+            div = self.parents[div]
+            if div == NO_PARENT:
+                return None
+        if self.kinds[div] not in SOURCE_NODES:
+            return None
+        row = self.extra_ids[div]
+        if row == 0:
+            return None
+        if div != node:
+            style_name = self.get_style(node).name
+        else:
+            style_name = self.extras[self.source_names[row]]
+        return text.Provenance(
+            _from_column(self.source_paragraphs[row]),
+            _from_column(self.source_lines[row]),
+            _from_column(self.source_offsets[row]),
+            style_name)
+
+    def top_level(self):
+        """The indexes of the top-level nodes."""
+        ret = []
+        node = 0
+        while node < len(self.kinds):
+            ret.append(node)
+            node = self.ends[node]
+        return ret
+
+    def iter_kind(self, kinds):
+        """The indexes of the nodes of the given NODE_* kinds, in document
+        order."""
+        kinds = frozenset(kinds)
+        return itertools.compress(range(len(self.kinds)), map(kinds.__contains__, self.kinds))
+
+    def iter_text(self, kinds):
+        """The text of the nodes of the given NODE_* kinds, in document
+        order."""
+        text = self.text
+        offsets = self.offsets
+        lengths = self.lengths
+        for node in self.iter_kind(kinds):
+            offset = offsets[node]
+            yield text[offset:offset + lengths[node]]
+
+    def view(self, node):
+        """A read-only text object for the node."""
+        kind = self.kinds[node]
+        if kind == NODE_MEDIA:
+            return self.get_extra(node)
+        return VIEW_CLASSES[kind](self, node)
+
+    def sections(self):
+        """Views of the top-level nodes."""
+        for node in self.top_level():
+            yield self.view(node)
+
+    def __add(self, obj, parent):
+        node = len(self.kinds)
+        if isinstance(obj, text.Chapter):
+            kind = NODE_CHAPTER
+            extra = (obj.name, obj.index)
+        elif isinstance(obj, text.SideBar):
+            kind = NODE_SIDEBAR
+            extra = obj.source
+        elif isinstance(obj, text.Para):
+            kind = NODE_PARA
+            extra = obj.source
+        elif isinstance(obj, text.SeparatorLine):
+            kind = NODE_SEPARATOR
+            extra = obj.source
+        elif isinstance(obj, text.SpecialCharacter):
+            kind = NODE_SPECIAL
+            if obj.is_whitespace:
+                kind = NODE_SPECIAL_WHITESPACE
+            extra = obj.html
+        elif isinstance(obj, text.Text):
+            kind = NODE_TEXT
+            extra = None
+        elif isinstance(obj, text.Correction):
+            kind = NODE_CORRECTION
+            extra = obj.original
+        elif isinstance(obj, text.Media):
+            kind = NODE_MEDIA
+            extra = obj
+        else:
+            raise Exception("Can't store {0} in a DocumentArena".format(obj))
+        start = self.__size
+        self.offsets.append(start)
+        self.lengths.append(0)
+        self.style_ids.append(self.__get_style_id(obj.style))
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.ends.append(0)
+        if kind in SOURCE_NODES:
+            self.extra_ids.append(self.__add_source(extra))
+        else:
+            self.extra_ids.append(self.__get_extra_id(extra))
+        if kind == NODE_TEXT or kind == NODE_SPECIAL or kind == NODE_SPECIAL_WHITESPACE:
+            if len(obj.text) > 0:
+                self.__pieces.append(obj.text)
+                self.__size += len(obj.text)
+        elif kind in DIV_NODES:
+            for child in obj.get_children():
+                self.__add(child, node)
+        self.lengths[node] = self.__size - start
+        self.ends[node] = len(self.kinds)
+        return node
+
+    def __get_style_id(self, style):
+        ret = self.__style_ids.get(style)
+        if ret is None:
+            ret = len(self.styles)
+            self.styles.append(style)
+            self.__style_ids[style] = ret
+        return ret
+
+    def __add_source(self, source):
+        """Add the source's row, and return its index."""
+        if not isinstance(source, text.Provenance):
+            return 0
+        self.source_paragraphs.append(_to_column(source.paragraph))
+        self.source_lines.append(_to_column(source.line))
+        self.source_offsets.append(_to_column(source.offset))
+        self.source_names.append(self.__get_extra_id(source.style_name))
+        return len(self.source_names) - 1
+
+    def __get_extra_id(self, extra):
+        if extra is None:
+            return 0
+        if not isinstance(extra, str):
+            # Media objects and chapter names are not shared between nodes.
+            self.extras.append(extra)
+            return len(self.extras) - 1
+        ret = self.__extra_ids.get(extra)
+        if ret is None:
+            ret = len(self.extras)
+            self.extras.append(extra)
+            self.__extra_ids[extra] = ret
+        return ret
+
+    def __getstate__(self):
+        # Join the text first.
+        self.text
+        return self.__dict__
+
+
+def _to_column(val):
+    if val is None:
+        return NO_VALUE
+    return val
+
+
+def _from_column(val):
+    if val == NO_VALUE:
+        return None
+    return val
+
+
+def from_sections(sections):
+    """A DocumentArena with the sections, such as those of an InputFile."""
+    ret = DocumentArena()
+    for section in sections:
+        ret.add_section(section)
+    return ret
+
+
+class ArenaView(object):
+    """
+    The parts that all the views over a DocumentArena node have in common.
+    Each view class also inherits from the text class it stands for, and
+    has the slots `arena` and `node`.
+    """
+    __slots__ = ()
+
+    @property
+    def style(self):
+        return self.arena.get_style(self.node)
+
+    @property
+    def source(self):
+        return self.arena.get_source(self.node)
+
+    def get_text(self):
+        return self.arena.get_text(self.node)
+
+    def get_children(self):
+        return [self.arena.view(child) for child in self.arena.get_children(self.node)]
+
+    def __eq__(self, other):
+        return (isinstance(other, ArenaView) and self.arena is other.arena and
+                self.node == other.node)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.arena), self.node))
+
+
+class DivView(ArenaView):
+    __slots__ = ()
+
+    @property
+    def is_section(self):
+        return self.arena.get_kind(self.node) == NODE_CHAPTER
+
+    def add_div(self, div):
+        raise Exception("DocumentArena views can't be changed")
+
+    def add_span(self, span):
+        raise Exception("DocumentArena views can't be changed")
+
+    def invalidate_text(self):
+        pass
+
+
+class ChapterView(DivView, text.Chapter):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def name(self):
+        return self.arena.get_extra(self.node)[0]
+
+    @property
+    def index(self):
+        return self.arena.get_extra(self.node)[1]
+
+    @property
+    def is_toc(self):
+        return False
+
+    @property
+    def is_book(self):
+        return False
+
+    @property
+    def divs(self):
+        return self.get_children()
+
+
+class SideBarView(DivView, text.SideBar):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def divs(self):
+        return self.get_children()
+
+
+class ParaView(DivView, text.Para):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def spans(self):
+        return self.get_children()
+
+
+class SeparatorLineView(DivView, text.SeparatorLine):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+
+class TextView(ArenaView, text.Text):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def text(self):
+        return self.get_text()
+
+
+class SpecialCharacterView(ArenaView, text.SpecialCharacter):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    @property
+    def html(self):
+        return self.arena.get_extra(self.node)
+
+    @property
+    def is_whitespace(self):
+        return self.arena.get_kind(self.node) == NODE_SPECIAL_WHITESPACE
+
+
+class CorrectionView(ArenaView, text.Correction):
+    __slots__ = ('arena', 'node')
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    @property
+    def text(self):
+        return ""
+
+    @property
+    def original(self):
+        return self.arena.get_extra(self.node)
+
+
+# NODE_* kind -> view class
+VIEW_CLASSES = {
+    NODE_CHAPTER: ChapterView,
+    NODE_SIDEBAR: SideBarView,
+    NODE_PARA: ParaView,
+    NODE_SEPARATOR: SeparatorLineView,
+    NODE_TEXT: TextView,
+    NODE_SPECIAL: SpecialCharacterView,
+    NODE_SPECIAL_WHITESPACE: SpecialCharacterView,
+    NODE_CORRECTION: CorrectionView,
+}
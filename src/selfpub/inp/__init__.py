@@ -3,4 +3,10 @@ from .inpf import InputFile
 
 from .odt import ODTInputFile
 
+from .fodt import FlatODTInputFile
+
 from .cleaner import Cleaner
+
+from .cache import ParseCache, CleanCache
+
+from .journal import CorrectionJournal, load_journal
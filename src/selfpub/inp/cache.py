@@ -0,0 +1,253 @@
+"""
+On-disk caches for parsed input.
+"""
+
+import collections
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+
+# Default upper limit for the size of the parse cache directory.
+DEFAULT_PARSE_CACHE_SIZE = 512 * 1024 * 1024
+
+PARSE_CACHE_EXT = ".parsed"
+
+
+CacheEntry = collections.namedtuple('CacheEntry', ('key', 'size', 'last_used'))
+
+
+class ParseCache(object):
+    """
+    A directory of parsed documents, keyed by a hash of the input files
+    and parser version.  Each entry is the pickled list of sections,
+    compressed.  When the directory grows over `max_size` bytes, the least
+    recently used entries are removed.
+    """
+    def __init__(self, directory, max_size=DEFAULT_PARSE_CACHE_SIZE):
+        object.__init__(self)
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key):
+        """Return the stored data for the key, or None if it is not cached."""
+        fname = self.__filename(key)
+        try:
+            with open(fname, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # A damaged entry.
+            self.remove(key)
+            self.misses += 1
+            return None
+        # Mark it as recently used.
+        os.utime(fname, None)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        fname = self.__filename(key)
+        # Each writer has its own temporary file, so that processes storing
+        # the same key don't write over each other.
+        fd, tmpname = tempfile.mkstemp(
+            prefix=key + ".", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmpname, fname)
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+        self.evict()
+
+    def remove(self, key):
+        fname = self.__filename(key)
+        if os.path.isfile(fname):
+            os.unlink(fname)
+
+    def entries(self):
+        """All the cached entries, most recently used first."""
+        ret = []
+        for name in os.listdir(self.directory):
+            if name.endswith(PARSE_CACHE_EXT):
+                st = os.stat(os.path.join(self.directory, name))
+                ret.append(CacheEntry(
+                    name[:-len(PARSE_CACHE_EXT)], st.st_size, st.st_mtime))
+        ret.sort(key=lambda e: e.last_used, reverse=True)
+        return ret
+
+    def total_size(self):
+        return sum(e.size for e in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in
+        its maximum size."""
+        entries = self.entries()
+        size = sum(e.size for e in entries)
+        while size > self.max_size and len(entries) > 0:
+            entry = entries.pop()
+            self.remove(entry.key)
+            size -= entry.size
+
+    def clear(self):
+        for entry in self.entries():
+            self.remove(entry.key)
+
+    def __filename(self, key):
+        return os.path.join(self.directory, key + PARSE_CACHE_EXT)
+
+
+# Default upper limit for the size of the cleaned paragraph cache data.
+DEFAULT_CLEAN_CACHE_SIZE = 64 * 1024 * 1024
+
+CLEAN_CACHE_FILE = "cleaned.sqlite"
+
+# Number of changes held in memory before they are written.
+CLEAN_CACHE_WRITE_INTERVAL = 1000
+
+
+class CleanCache(object):
+    """
+    The cleaned spans of paragraphs, keyed by a hash of the paragraph and
+    the cleaning rules, in an sqlite file in `directory`.  When the stored
+    data grows over `max_size` bytes, the least recently used entries are
+    removed.
+
+    New entries and use times are held in memory and written together in
+    one short transaction, so several processes can share the file; call
+    flush() when done.  The connection is opened on first use, so the
+    cache can be handed to worker processes.
+    """
+    def __init__(self, directory, max_size=DEFAULT_CLEAN_CACHE_SIZE):
+        object.__init__(self)
+        self.directory = directory
+        self.filename = os.path.join(directory, CLEAN_CACHE_FILE)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__db = None
+        # key -> data, not yet written
+        self.__added = {}
+        # keys that were used, whose use time is not yet written
+        self.__used = set()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_CleanCache__db'] = None
+        state['_CleanCache__added'] = {}
+        state['_CleanCache__used'] = set()
+        return state
+
+    def get(self, key):
+        """Return the stored data for the key, or None if it is not cached."""
+        ret = self.__added.get(key)
+        if ret is None:
+            row = self.__connect().execute(
+                "SELECT data FROM cleaned WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            ret = row[0]
+            # Mark it as recently used.
+            self.__used.add(key)
+            self.__changed()
+        self.hits += 1
+        return ret
+
+    def put(self, key, data):
+        self.__added[key] = data
+        self.__changed()
+
+    def remove(self, key):
+        self.__added.pop(key, None)
+        self.__used.discard(key)
+        self.__connect().execute("DELETE FROM cleaned WHERE key = ?", (key,))
+
+    def entries(self):
+        """All the cached entries, most recently used first."""
+        self.flush()
+        return [CacheEntry(*row) for row in self.__connect().execute(
+            "SELECT key, size, last_used FROM cleaned ORDER BY last_used DESC")]
+
+    def total_size(self):
+        self.flush()
+        return self.__get_size()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in
+        its maximum size."""
+        size = self.__get_size()
+        if size <= self.max_size:
+            return
+        db = self.__connect()
+        remove = []
+        for key, entry_size in db.execute(
+                "SELECT key, size FROM cleaned ORDER BY last_used"):
+            if size <= self.max_size:
+                break
+            remove.append((key,))
+            size -= entry_size
+        db.execute("BEGIN IMMEDIATE")
+        db.executemany("DELETE FROM cleaned WHERE key = ?", remove)
+        db.execute("COMMIT")
+
+    def clear(self):
+        self.__added = {}
+        self.__used = set()
+        self.__connect().execute("DELETE FROM cleaned")
+
+    def flush(self):
+        """Write the changes, and evict old entries."""
+        if len(self.__added) <= 0 and len(self.__used) <= 0:
+            return
+        now = time.time()
+        db = self.__connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO cleaned (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                [(key, data, len(data), now) for key, data in self.__added.items()])
+            db.executemany(
+                "UPDATE cleaned SET last_used = ? WHERE key = ?",
+                [(now, key) for key in self.__used])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self.__added = {}
+        self.__used = set()
+        self.evict()
+
+    def __get_size(self):
+        row = self.__connect().execute("SELECT SUM(size) FROM cleaned").fetchone()
+        return row[0] or 0
+
+    def __changed(self):
+        if len(self.__added) + len(self.__used) >= CLEAN_CACHE_WRITE_INTERVAL:
+            self.flush()
+
+    def __connect(self):
+        if self.__db is None:
+            # Autocommit; flush() makes its own transaction.
+            self.__db = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS cleaned ("
+                "key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_used REAL)")
+            self.__db.execute(
+                "CREATE INDEX IF NOT EXISTS cleaned_last_used ON cleaned (last_used)")
+        return self.__db
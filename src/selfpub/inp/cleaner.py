@@ -2,6 +2,14 @@
 Cleans up a messy input file.
 """
 
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
 from .inpf import InputFile
 from .. import text
 
@@ -36,6 +44,26 @@ UNICODE_SPACES = [
     u'\u3000',  # IDEOGRAPHIC SPACE - The width of ideographic (CJK) characters.
     u'\uFEFF',  # ZERO WIDTH NO-BREAK SPACE - No width (the character is invisible)
 ]
+# Number of sections handed to a worker process at a time.
+CLEAN_BATCH_SIZE = 100
+
+# Number of characters of the paragraph given with a lint issue about the
+# whole paragraph.
+LINT_CONTEXT = 40
+
+# Paragraphs with up to this many characters of plain text are remembered,
+# and up to PARA_MEMO_SIZE of them are kept.
+PARA_MEMO_LENGTH = 40
+PARA_MEMO_SIZE = 1000
+# Remembered in place of the cleaned spans of paragraphs that were removed,
+# or turned into separator lines.
+MEMO_REMOVED = object()
+MEMO_SEPARATOR = object()
+
+# Change this whenever clean_para changes its output, so that cached
+# cleaned paragraphs are not used.
+CLEANER_VERSION = "2"
+
 # Need special handling for:
 # ' - ': '&nbsp;&ndash; '
 # u' \u2013': '&nbsp;&ndash;',  # long dash
@@ -45,21 +73,182 @@ UNICODE_SPACES = [
 
 
 class Cleaner(InputFile):
-    def __init__(self, md, proxy):
+    """
+    Cleans the text of the sections read from another input file.  The
+    typographic changes are made by a RuleSet (by default, DEFAULT_RULES;
+    see get_locale_rules() for other languages).
+
+    With `parallel`, the sections are cleaned in batches of `batch_size`
+    by a pool of `workers` processes (by default, one per CPU), and
+    returned in their original order.  Only a few batches per worker are
+    read ahead.  Subclasses that carry state from one section to the next
+    must set `stateful` to True; these are always cleaned one at a time,
+    in this process.
+
+    With a `cache` (a cache.CleanCache), the cleaned spans of each
+    paragraph are stored under a hash of its spans and the rules, and
+    paragraphs that have been cleaned before are not cleaned again.
+
+    With a `journal` (a journal.CorrectionJournal), the corrections are
+    taken out of the cleaned paragraphs and added to the journal, so the
+    returned spans only contain renderable content.
+
+    Short paragraphs of plain text (up to `memo_length` characters, such
+    as "Yes." or "* * *") are cleaned once; the most recent `memo_size` of
+    them are remembered, and paragraphs whose spans have the same text and
+    styles get the same cleaned span objects (with the source of the first
+    such paragraph), as a shared tuple.  `memo_length` of 0 turns this off.
+    """
+    stateful = False
+
+    def __init__(self, md, proxy, rules=None, parallel=False, workers=None,
+                 batch_size=CLEAN_BATCH_SIZE, cache=None, journal=None,
+                 memo_length=PARA_MEMO_LENGTH, memo_size=PARA_MEMO_SIZE):
         InputFile.__init__(self)
         self.__proxy = proxy
         self.__md = md
         self.expect_paragraphs_to_start_with_tab = True
+        if rules is None:
+            rules = DEFAULT_RULES
+        elif not isinstance(rules, RuleSet):
+            rules = RuleSet(rules)
+        self.rules = rules
+        self.parallel = parallel
+        self.workers = workers
+        self.batch_size = batch_size
+        self.cache = cache
+        self.journal = journal
+        self.memo_length = memo_length
+        self.memo_size = memo_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        # memo key -> tuple of cleaned spans, MEMO_REMOVED or MEMO_SEPARATOR
+        self.__memo = collections.OrderedDict()
+        self.__paragraph_count = 0
+
+    def __getstate__(self):
+        # The worker processes get the settings, but not the input file.
+        # The corrections are journaled in this process.
+        state = dict(self.__dict__)
+        state['_Cleaner__proxy'] = None
+        state['journal'] = None
+        state['_Cleaner__memo'] = collections.OrderedDict()
+        return state
 
     def sections(self):
+        try:
+            if self.parallel and not self.stateful:
+                cleaned = self.clean_parallel(self.__proxy.sections())
+            else:
+                cleaned = self.__clean_sections()
+            for val in cleaned:
+                if self.journal is not None:
+                    self.journal_section(val)
+                yield val
+        finally:
+            if self.cache is not None:
+                self.cache.flush()
+            if self.journal is not None:
+                self.journal.flush()
+
+    def __clean_sections(self):
         for sec in self.__proxy.sections():
             val = self.clean_section(sec)
             if val is not None:
                 yield val
 
+    def journal_section(self, sec):
+        """Move the Correction spans of the cleaned section's paragraphs
+        into the journal."""
+        for para in iter_paras(sec):
+            self.__paragraph_count += 1
+            ordinal = self.__paragraph_count
+            if isinstance(para.source, text.Provenance):
+                ordinal = para.source.paragraph
+            spans = []
+            offset = 0
+            for span in para.spans:
+                if isinstance(span, text.Correction):
+                    self.journal.append(ordinal, offset, span.original)
+                else:
+                    spans.append(span)
+                    offset += len(span.get_text())
+            if len(spans) != len(para.spans):
+                para.spans = spans
+
+    def clean_parallel(self, sections):
+        """Clean the sections on a process pool; see the class
+        documentation."""
+        workers = self.workers
+        if workers is None:
+            workers = os.cpu_count() or 1
+        pool = None
+        pending = collections.deque()
+        batch = []
+        try:
+            for sec in sections:
+                batch.append(sec)
+                if len(batch) < self.batch_size:
+                    continue
+                if pool is None:
+                    pool = concurrent.futures.ProcessPoolExecutor(
+                        workers, initializer=_init_clean_worker, initargs=(self,))
+                kept = []
+                pending.append((pool.submit(_clean_batch, dumps_sections(batch, kept)), kept))
+                batch = []
+                while len(pending) > workers * 2:
+                    for val in _load_batch(*pending.popleft()):
+                        yield val
+            while len(pending) > 0:
+                for val in _load_batch(*pending.popleft()):
+                    yield val
+            # Not worth handing the last, partial batch to a worker.
+            for sec in batch:
+                val = self.clean_section(sec)
+                if val is not None:
+                    yield val
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
     def get_metadata(self):
         return self.__md
 
+    def lint(self):
+        """
+        Report-only mode: read the sections, and yield an Issue for each
+        correction the rules would make and each paragraph that does not
+        start with a tab, without building the cleaned spans.  Only one
+        section is held at a time.
+
+        The rules are run over the whole text of each paragraph (see
+        lint_para), so this is fastest with an input that gives cheap
+        get_text() calls, such as ODTInputFile(lazy_paras=True).
+        """
+        ordinal = 0
+        for sec in self.__proxy.sections():
+            for para in iter_paras(sec):
+                ordinal += 1
+                for issue in self.lint_para(para, ordinal):
+                    yield issue
+
+    def lint_para(self, para, ordinal):
+        """The Issues for the paragraph.  The issues use the paragraph
+        number from the source of the paragraph if it has one, otherwise
+        `ordinal`; the offsets are into the paragraph's text."""
+        src = para.get_text()
+        if isinstance(para.source, text.Provenance):
+            ordinal = para.source.paragraph
+        issues = []
+        # The text is checked first, so that the spans (which a LazyPara
+        # has to parse) are only looked at when it does not start with a
+        # tab.
+        if (self.expect_paragraphs_to_start_with_tab and len(src) > 0 and
+                src[0] != '\t' and self.is_bad_para_start(para)):
+            issues.append(Issue(ordinal, 0, "paragraph-start", src[:LINT_CONTEXT]))
+        self.rules.apply(src, LintEmitter(ordinal, issues))
+        return issues
+
     def clean_section(self, sec):
         print("cleaning {0}".format(sec))
         if isinstance(sec, text.Para):
@@ -79,7 +268,7 @@ class Cleaner(InputFile):
             return sec
         elif isinstance(sec, text.Text):
             kids = []
-            self.clean_text(sec, kids, "")
+            self.clean_text(sec, kids, None)
             if len(kids) == 0:
                 return None
             elif len(kids) == 1:
@@ -90,17 +279,78 @@ class Cleaner(InputFile):
             # raise Exception("Unknown section clean {0}".format(sec))
             return sec
 
+    def get_memo_hit_rate(self):
+        total = self.memo_hits + self.memo_misses
+        if total <= 0:
+            return 0.0
+        return self.memo_hits / total
+
     def clean_para(self, para):
         assert isinstance(para, text.Para)
+        key = self.get_memo_key(para.spans)
+        if key is None:
+            return self.clean_para_spans(para)
+        memo = self.__memo
+        if key in memo:
+            self.memo_hits += 1
+            memo.move_to_end(key)
+            val = memo[key]
+            if self.expect_paragraphs_to_start_with_tab:
+                self.check_para_start(para.spans[0])
+            if val is MEMO_REMOVED:
+                return None
+            if val is MEMO_SEPARATOR:
+                ret = text.SeparatorLine()
+                ret.source = para.source
+                return ret
+            para.spans = val
+            return para
+        self.memo_misses += 1
+        ret = self.clean_para_spans(para)
+        if ret is None:
+            val = MEMO_REMOVED
+        elif ret is para:
+            val = tuple(para.spans)
+            para.spans = val
+        elif isinstance(ret, text.SeparatorLine):
+            val = MEMO_SEPARATOR
+        else:
+            # Made by a subclass; don't know how to share it.
+            return ret
+        memo[key] = val
+        if len(memo) > self.memo_size:
+            memo.popitem(last=False)
+        return ret
+
+    def get_memo_key(self, spans):
+        """The key for remembering the cleaned paragraph with these spans,
+        or None if it should not be remembered."""
+        if self.memo_length <= 0 or self.memo_size <= 0 or len(spans) <= 0:
+            return None
+        size = 0
+        key = []
+        for span in spans:
+            if type(span) is not text.Text:
+                return None
+            size += len(span.text)
+            if size > self.memo_length:
+                return None
+            key.append(span.style)
+            key.append(span.text)
+        return tuple(key)
+
+    def clean_para_spans(self, para):
+        """clean_para, without the memo."""
+        if self.cache is not None:
+            return self.clean_para_cached(para)
         new_spans = []
-        parsed = ""
+        parsed = None
         first = self.expect_paragraphs_to_start_with_tab
         for span in para.spans:
             if isinstance(span, text.Text):
                 if first:
                     first = False
-                    if len(span.text) > 0 and span.text[0] != '\t':
-                        print("*** Does not start with tab: {!r}".format(span.text))
+                    self.check_para_start(span)
                 parsed = self.clean_text(span, new_spans, parsed)
             else:
                 new_spans.append(span)
@@ -108,6 +358,77 @@ class Cleaner(InputFile):
         para.spans = new_spans
         return self.special_para_handling(para)
 
+    def check_para_start(self, span):
+        """Warn if the first text of the paragraph does not start with a
+        tab."""
+        if len(span.text) > 0 and span.text[0] != '\t':
+            print("*** Does not start with tab ({0}): {1!r}".format(
+                span.source, span.text))
+
+    def is_bad_para_start(self, para):
+        """Whether cleaning the paragraph warns that it does not start with
+        a tab: the same test as check_para_start, on the first Text
+        span."""
+        for span in para.spans:
+            if isinstance(span, text.Text):
+                return len(span.text) > 0 and span.text[0] != '\t'
+        return False
+
+    def clean_para_cached(self, para):
+        """
+        clean_para, using the cache.  The cached entry records each cleaned
+        span by the index of the span it came from, so the style and source
+        of the spans come from this paragraph.
+        """
+        spans = para.spans
+        key = self.get_para_key(spans)
+        data = self.cache.get(key)
+        if data is None:
+            # Remember which span each cleaned span came from, as id ->
+            # (index, cleaned span).  Holding on to the cleaned span keeps
+            # its id from being reused when clean_text drops it.
+            origin = {}
+            new_spans = []
+            parsed = None
+            first = self.expect_paragraphs_to_start_with_tab
+            for index, span in enumerate(spans):
+                if isinstance(span, text.Text):
+                    if first:
+                        first = False
+                        self.check_para_start(span)
+                    parsed = self.clean_text(span, new_spans, parsed)
+                else:
+                    new_spans.append(span)
+                # New spans are only ever added to the end.
+                for new_span in reversed(new_spans):
+                    if id(new_span) in origin:
+                        break
+                    origin[id(new_span)] = (index, new_span)
+            _strip_trailing_whitespace(new_spans, "")
+            self.cache.put(key, _dumps_cleaned_spans(new_spans, origin))
+        else:
+            if self.expect_paragraphs_to_start_with_tab:
+                for span in spans:
+                    if isinstance(span, text.Text):
+                        self.check_para_start(span)
+                        break
+            new_spans = _loads_cleaned_spans(data, spans)
+        para.spans = new_spans
+        return self.special_para_handling(para)
+
+    def get_para_key(self, spans):
+        """Hash of everything the cleaned spans of the paragraph depend
+        upon."""
+        ret = hashlib.sha256()
+        ret.update("{0}/{1}".format(CLEANER_VERSION, self.rules.version).encode())
+        for span in spans:
+            if isinstance(span, text.Text):
+                ret.update(b"\0T" + (span.style.name or "").encode() + b"\0" +
+                           span.text.encode("utf-8", "surrogatepass"))
+            else:
+                ret.update(b"\0O")
+        return ret.hexdigest()
+
     def special_para_handling(self, para):
         contents = para.get_text().strip()
         if len(contents) == 0:
@@ -120,134 +441,507 @@ class Cleaner(InputFile):
             return ret
         return para
 
-    def clean_text(self, text_node, spans, parsed):
+    def clean_text(self, text_node, spans, state):
+        """
+        Clean the text node's text, adding the cleaned spans to `spans`.
+        `state` is the CleanState returned from cleaning the previous text
+        in the paragraph, or None at the start of the paragraph.  Returns
+        the new CleanState.
+        """
+        if state is None:
+            state = START_STATE
         if text_node.text is None or text_node.text == "":
-            return parsed
-        val = ""
+            return state
         print("cleaning {!r}".format(text_node))
-        for ch in text_node.text:
-            # print("  - [{0}]".format(ord(ch)))
-            # if ch == '\t':
-            #    # special tab handling; happens before we join the parsed text.
-            #
-            #    # First, strip off whitespace at the end of the val.
-            #    val = _strip_trailing_whitespace(spans, val)
-            #
-            #    # Then add in the previous value as a node
-            #    val = _join_text(spans, text_node, val)
-            #
-            #    # Add in the tab as a special character
-            #    spans.append(_special_text(text_node, ch, "&nbsp;", True))
-            #
-            #    parsed = parsed.rstrip() + " "
-            #    continue
-
-            # Special characters that are whitespace sensitive, before double-whitespace checks
-            if ch == '-' or ch == u'\u2013':
-                # possible long dash
-                if parsed[-1] == " ":
-                    # long dash with a leading space
-                    # Note that we check "parsed", because we want to replace the previous
-                    # whitespace with a non-breaking space.
-                    val = _strip_trailing_whitespace(spans, val)
-                    parsed = parsed.rstrip() + " -"
-                    val = _join_text(spans, text_node, val)
-                    spans.append(_special_text(text_node, u" \u2013", "&nbsp;&ndash;", False))
-                elif ch == u'\u2013':
-                    # explicit long dash in the middle of stand-alone text.
-                    val = _join_text(spans, text_node, val)
-                    spans.append(_special_text(text_node, ch, "&ndash;", False))
-                    parsed += "-"
-                else:
-                    val = _join_text(spans, text_node, val)
-                    spans.append(_special_text(text_node, ch, ch, False))
-                    parsed += ch
-                continue
-
-            # 201c: open double quote
-            # 201d: closed double quote
-            if ch in [u'\u201C', u'\u201D', '"']:
-                val = _join_text(spans, text_node, val)
-
-                # Check whitespace before hand.  If there is an odd number of previous double quotes,
-                # then we want to turn this into an open double quote with an explicit space
-                # before it.
-                quote_count = parsed.count('"')
-                if quote_count % 2 == 1:
-                    # Odd number of previously found double quotes.  Make this a closed double quote.
-                    if _has_trailing_whitespace(parsed):
-                        # Closing double quotes should always be without whitespace before it
-                        span = text.Correction(" " + ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                        val = _strip_trailing_whitespace(spans, val)
-                        parsed = parsed.rstrip()
-                    elif ch != u'\u201D':
-                        span = text.Correction(ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                    spans.append(_special_text(text_node, u'\u201D', '&rdquo;', False))
-                else:
-                    # Even number of previously found double quotes.  Make this an open double quote.
-                    if not _has_trailing_whitespace(parsed):
-                        # Open double quotes should always have leading whitespace.  Note that an empty
-                        # parsed string (beginning of paragraph) is marked as whitespace, so this won't insert
-                        # whitespace at the start.
-                        span = text.Correction(ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                    elif ch != u'\u201C':
-                        span = text.Correction(ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                    spans.append(_special_text(text_node, u'\u201C', '&ldquo;', False))
-
-                # Mark in the parsed as a normal double quote
-                parsed += '"'
-                continue
-
-            # u'\u2018' close open quote
-            # u'\u2019' close single quote
-            if ch in [u'\u2018', u'\u2019', "'"]:
-                val = _join_text(spans, text_node, val)
-
-                # Single quotes are more difficult to handle.  If there is whitespace before it, then we consider
-                # it to be an open quote.  In all other cases (including contractions and possessives), it's
-                # a closed quote.
-                if _has_trailing_whitespace(parsed):
-                    if ch != '\u2018':
-                        span = text.Correction(ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                    spans.append(_special_text(text_node, '\u2018', '&lsquo;', False))
-                else:
-                    if ch != u'\u2019':
-                        span = text.Correction(ch)
-                        span.style = text_node.style
-                        spans.append(span)
-                    spans.append(_special_text(text_node, '\u2019', '&rsquo;', False))
-
-                # Mark in the parsed as a normal single quote
-                parsed += "'"
-                continue
-
-            # Check if we have multiple whitespace
-            if ch.isspace() or ch in UNICODE_SPACES:
-                # Convert any other whitespace character to a simple space.
-                if len(parsed) <= 0 or parsed[-1] == " ":
-                    # already have a previous white space.  Ignore.
-                    continue
-                ch = " "
+        out = SpanEmitter(text_node, spans, state)
+        self.rules.apply(text_node.text, out)
+        return out.finish()
+
+
+class CleanState(collections.namedtuple('CleanState', ('last', 'flags'))):
+    """
+    What the rules need to know about the text cleaned so far in the
+    paragraph: the last character ("" at the start, and " " for any
+    whitespace), and the frozenset of flags that the rules have set (such
+    as an open double quote).
+    """
+    __slots__ = ()
+
+
+START_STATE = CleanState("", frozenset())
+
+
+class SpanEmitter(object):
+    """
+    Where the rules send the cleaned text of a text node: plain text is
+    collected, and added as a Text span before each special character or
+    correction span.
+    """
+    def __init__(self, text_node, spans, state):
+        object.__init__(self)
+        self.text_node = text_node
+        self.spans = spans
+        self.last = state.last
+        self.flags = set(state.flags)
+        # Set by the RuleSet: the offset of the match in the text, and the
+        # rule that is handling it.
+        self.position = 0
+        self.rule = None
+        self.__val = []
+
+    @property
+    def at_whitespace(self):
+        """Whether the cleaned text ends in whitespace, or is empty."""
+        return self.last == "" or self.last == " "
+
+    def text(self, val):
+        """Add plain text."""
+        self.__val.append(val)
+        self.last = val[-1]
+
+    def special(self, val, html, is_whitespace=False):
+        """Add a special character."""
+        self.__join()
+        self.spans.append(_special_text(self.text_node, val, html, is_whitespace))
+        if is_whitespace:
+            self.last = " "
+        else:
+            self.last = val[-1]
+
+    def correction(self, original):
+        """Mark that the original text was replaced by what follows."""
+        self.__join()
+        self.spans.append(_correction(self.text_node, original))
+
+    def strip_trailing_whitespace(self):
+        """Remove the whitespace at the end of the cleaned text."""
+        val = _strip_trailing_whitespace(self.spans, "".join(self.__val))
+        self.__val = []
+        _join_text(self.spans, self.text_node, val)
+
+    def finish(self):
+        """Add the remaining text, and return the new CleanState."""
+        self.__join()
+        return CleanState(self.last, frozenset(self.flags))
+
+    def __join(self):
+        if len(self.__val) > 0:
+            _join_text(self.spans, self.text_node, "".join(self.__val))
+            self.__val = []
+
+
+Issue = collections.namedtuple('Issue', ('paragraph', 'offset', 'rule', 'original'))
+
+
+class LintEmitter(object):
+    """
+    Takes the place of the SpanEmitter in lint mode.  The text is not
+    kept; each correction is added to `issues` as an Issue.
+    """
+    def __init__(self, paragraph, issues):
+        object.__init__(self)
+        self.paragraph = paragraph
+        self.issues = issues
+        self.last = ""
+        self.flags = set()
+        self.position = 0
+        self.rule = None
+
+    @property
+    def at_whitespace(self):
+        return self.last == "" or self.last == " "
+
+    def text(self, val):
+        self.last = val[-1]
+
+    def special(self, val, html, is_whitespace=False):
+        if is_whitespace:
+            self.last = " "
+        else:
+            self.last = val[-1]
+
+    def correction(self, original):
+        self.issues.append(Issue(self.paragraph, self.position, self.rule.name, original))
+
+    def strip_trailing_whitespace(self):
+        pass
+
+
+def write_lint_report(issues, out):
+    """Write the issues to the text stream, one JSON list per line."""
+    count = 0
+    for issue in issues:
+        out.write(json.dumps(issue, ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
 
-            parsed += ch
-            val += ch
-        _join_text(spans, text_node, val)
-        return parsed
+def iter_paras(sec):
+    """The paragraphs in the section, in the same order as clean_section
+    goes through them."""
+    if isinstance(sec, text.Para):
+        yield sec
+    elif isinstance(sec, text.Chapter) or isinstance(sec, text.SideBar):
+        for div in sec.divs:
+            for para in iter_paras(div):
+                yield para
+
+
+class CleanRule(object):
+    """
+    A typographic rule.  `pattern` is the regular expression (without
+    named groups) for the text that the rule handles; apply() is called
+    with each match, and sends the replacement to the SpanEmitter.
+    """
+    pattern = None
+    # Identifies the rule in lint issues.
+    name = None
+    # Change this whenever the rule changes its output.
+    version = "1"
+
+    def get_version(self):
+        """Identifies the rule and its settings, for cached results."""
+        return "{0}.{1}/{2}/{3}".format(
+            type(self).__module__, type(self).__name__, self.version, self.pattern)
+
+    def apply(self, found, out):
+        raise NotImplementedError()
+
+
+class CharacterRule(CleanRule):
+    """Replaces characters with special characters, from a table of
+    character to HTML, such as TRANSLATE_CHARACTERS."""
+    name = "character"
+
+    def __init__(self, table):
+        CleanRule.__init__(self)
+        self.table = dict(table)
+        self.pattern = u"|".join(re.escape(key) for key in
+                                 sorted(self.table, key=len, reverse=True))
+
+    def get_version(self):
+        return "{0}/{1!r}".format(CleanRule.get_version(self), sorted(self.table.items()))
+
+    def apply(self, found, out):
+        out.special(found, self.table[found])
+
+
+class WhitespaceRule(CleanRule):
+    """A run of whitespace becomes a single space, unless there is already
+    whitespace before it.  The whitespace is anything that str.isspace()
+    accepts (the same as the regular expression class), and UNICODE_SPACES."""
+    name = "whitespace"
+    pattern = u"[\\s{0}]+".format(u"".join(UNICODE_SPACES))
+
+    def apply(self, found, out):
+        if not out.at_whitespace:
+            out.text(" ")
+
+
+class DashRule(CleanRule):
+    """Dashes, which depend upon the whitespace before them."""
+    name = "dash"
+    pattern = u"[-\u2013]"
+
+    def apply(self, found, out):
+        if out.last == " ":
+            # long dash with a leading space; the previous whitespace is
+            # replaced with a non-breaking space.
+            out.strip_trailing_whitespace()
+            out.special(u" \u2013", "&nbsp;&ndash;")
+        elif found == u'\u2013':
+            # explicit long dash in the middle of stand-alone text.
+            out.special(found, "&ndash;")
+        else:
+            out.special(found, found)
+
+
+class DoubleQuoteRule(CleanRule):
+    """
+    Double quotes alternate between open and close quotes, whatever the
+    character used.  Open quotes should have whitespace before them, and
+    close quotes should not.
+    """
+    name = "double-quote"
+    pattern = u"[\u201C\u201D\"]"
+    flag = "double-quote"
+    open_quote = (u'\u201C', '&ldquo;')
+    close_quote = (u'\u201D', '&rdquo;')
+
+    def apply(self, found, out):
+        if self.flag in out.flags:
+            # Odd number of previously found double quotes.  Make this a
+            # closed double quote.
+            out.flags.discard(self.flag)
+            if out.at_whitespace:
+                # Closing double quotes should always be without
+                # whitespace before it
+                out.correction(" " + found)
+                out.strip_trailing_whitespace()
+            elif found != self.close_quote[0]:
+                out.correction(found)
+            out.special(*self.close_quote)
+        else:
+            # Even number of previously found double quotes.  Make this an
+            # open double quote.
+            out.flags.add(self.flag)
+            if not out.at_whitespace:
+                # Open double quotes should always have leading whitespace.
+                # Note that the start of the paragraph counts as whitespace,
+                # so this won't insert whitespace at the start.
+                out.correction(found)
+            elif found != self.open_quote[0]:
+                out.correction(found)
+            out.special(*self.open_quote)
+
+
+class SingleQuoteRule(CleanRule):
+    """
+    Single quotes are more difficult to handle.  If there is whitespace
+    before it, then we consider it to be an open quote.  In all other cases
+    (including contractions and possessives), it's a closed quote.
+    """
+    name = "single-quote"
+    pattern = u"[\u2018\u2019']"
+
+    def apply(self, found, out):
+        if out.at_whitespace:
+            if found != u'\u2018':
+                out.correction(found)
+            out.special(u'\u2018', '&lsquo;')
+        else:
+            if found != u'\u2019':
+                out.correction(found)
+            out.special(u'\u2019', '&rsquo;')
+
+
+class GermanDoubleQuoteRule(DoubleQuoteRule):
+    """German quotes: low open quotes and high close quotes."""
+    pattern = u"[\u201E\u201C\"]"
+    open_quote = (u'\u201E', '&bdquo;')
+    close_quote = (u'\u201C', '&ldquo;')
+
+
+class GuillemetRule(CleanRule):
+    """
+    French quotes: straight double quotes and guillemets become
+    guillemets, with a non-breaking space on the inside.  Any whitespace
+    already inside the guillemets is removed.
+    """
+    name = "guillemet"
+    pattern = u"[\u00AB\u201C\"][\\s{0}]*|\u00BB|\u201D".format(u"".join(UNICODE_SPACES))
+    flag = "guillemet"
+
+    def apply(self, found, out):
+        ch = found[0]
+        if ch == u'\u00AB' or (ch != u'\u00BB' and ch != u'\u201D' and
+                                self.flag not in out.flags):
+            out.flags.add(self.flag)
+            if ch != u'\u00AB':
+                out.correction(ch)
+            out.special(u"\u00AB\u00A0", "&laquo;&nbsp;", False)
+        else:
+            out.flags.discard(self.flag)
+            out.strip_trailing_whitespace()
+            if ch != u'\u00BB':
+                out.correction(ch)
+            out.special(u"\u00A0\u00BB", "&nbsp;&raquo;", False)
+            if len(found) > 1:
+                # The pattern took the whitespace after a straight quote.
+                out.text(" ")
+
+
+class RuleSet(object):
+    """
+    A list of rules, compiled into a single regular expression.  Rules
+    earlier in the list take precedence when they match at the same place.
+    The text between matches is passed through as it is, so the cost of
+    cleaning depends on the number of matches, not the number of rules.
+    """
+    def __init__(self, rules):
+        object.__init__(self)
+        self.rules = tuple(rules)
+        self.__by_group = {}
+        parts = []
+        for index, rule in enumerate(self.rules):
+            group = "r{0}".format(index)
+            self.__by_group[group] = rule
+            parts.append(u"(?P<{0}>{1})".format(group, rule.pattern))
+        self.regex = re.compile(u"|".join(parts))
+        self.version = hashlib.sha256("\0".join(
+            rule.get_version() for rule in self.rules).encode()).hexdigest()
+
+    def apply(self, src, out):
+        """Send the cleaned `src` text to the SpanEmitter."""
+        by_group = self.__by_group
+        pos = 0
+        for match in self.regex.finditer(src):
+            start = match.start()
+            if start > pos:
+                out.text(src[pos:start])
+            pos = match.end()
+            rule = by_group[match.lastgroup]
+            out.position = start
+            out.rule = rule
+            rule.apply(match.group(), out)
+        if pos < len(src):
+            out.text(src[pos:])
+
+    def extend(self, rules):
+        """A new RuleSet with the given rules added, at a lower
+        precedence."""
+        return RuleSet(self.rules + tuple(rules))
+
+
+DEFAULT_RULES = RuleSet((
+    DashRule(),
+    DoubleQuoteRule(),
+    SingleQuoteRule(),
+    WhitespaceRule(),
+))
+
+# language -> RuleSet
+LOCALE_RULES = {
+    "de": RuleSet((
+        DashRule(),
+        GermanDoubleQuoteRule(),
+        SingleQuoteRule(),
+        WhitespaceRule(),
+    )),
+    "fr": RuleSet((
+        DashRule(),
+        GuillemetRule(),
+        SingleQuoteRule(),
+        WhitespaceRule(),
+    )),
+}
+
+
+def get_locale_rules(language):
+    """The rules for the language ("fr", "de-AT", ...), or DEFAULT_RULES."""
+    if language is None:
+        return DEFAULT_RULES
+    return LOCALE_RULES.get(language.split("-")[0].lower(), DEFAULT_RULES)
+
+
+_worker_cleaner = None
+
+
+def _init_clean_worker(cleaner):
+    global _worker_cleaner
+    _worker_cleaner = cleaner
+
+
+def _clean_batch(data):
+    """Clean a batch of sections in a worker process."""
+    ret = []
+    for sec in loads_sections(data, None):
+        val = _worker_cleaner.clean_section(sec)
+        if val is not None:
+            ret.append(val)
+    if _worker_cleaner.cache is not None:
+        # The worker may not be used again.
+        _worker_cleaner.cache.flush()
+    return dumps_sections(ret, None)
+
+
+def _load_batch(future, kept):
+    return loads_sections(future.result(), kept)
+
+
+class KeptObject(text.Span):
+    """Stands in, in a worker process, for a Media span that stayed in the
+    main process.  It has the span's style and source, and no text, so the
+    paragraph is cleaned as it would be with the span itself."""
+    __slots__ = ('index',)
+
+    def __init__(self, index, style, source):
+        text.Span.__init__(self)
+        self.index = index
+        self.style = style
+        self.source = source
+
+
+class SectionPickler(pickle.Pickler):
+    """
+    Pickles sections for the worker processes.  Media objects can refer to
+    the input file, so they are not sent: in the main process, `kept` is
+    the list they are added to, and they are pickled as their index in it
+    (with their style and source); in a worker (where `kept` is None),
+    their KeptObject stand-ins are pickled as the same index.
+    """
+    def __init__(self, stream, kept):
+        pickle.Pickler.__init__(self, stream, pickle.HIGHEST_PROTOCOL)
+        self.kept = kept
+
+    def persistent_id(self, obj):
+        if isinstance(obj, KeptObject):
+            return obj.index
+        if self.kept is not None and isinstance(obj, text.Media):
+            self.kept.append(obj)
+            return (len(self.kept) - 1, obj.style, obj.source)
+        return None
+
+
+class SectionUnpickler(pickle.Unpickler):
+    def __init__(self, stream, kept):
+        pickle.Unpickler.__init__(self, stream)
+        self.kept = kept
+
+    def persistent_load(self, pid):
+        if self.kept is None:
+            return KeptObject(*pid)
+        return self.kept[pid]
+
+
+def dumps_sections(sections, kept):
+    out = io.BytesIO()
+    SectionPickler(out, kept).dump(sections)
+    return out.getvalue()
+
+
+def loads_sections(data, kept):
+    return SectionUnpickler(io.BytesIO(data), kept).load()
+
+
+def _dumps_cleaned_spans(spans, origin):
+    """Store the cleaned spans, as data that refers to the spans they came
+    from by index."""
+    ret = []
+    for span in spans:
+        index = origin[id(span)][0]
+        if type(span) is text.SpecialCharacter:
+            ret.append(("special", index, span.text, span.html, span.is_whitespace))
+        elif type(span) is text.Correction:
+            ret.append(("correction", index, span.original))
+        elif type(span) is text.Text:
+            ret.append(("text", index, span.text))
+        else:
+            ret.append(("keep", index))
+    return json.dumps(ret).encode()
+
+
+def _loads_cleaned_spans(data, spans):
+    ret = []
+    for entry in json.loads(data.decode()):
+        kind = entry[0]
+        span = spans[entry[1]]
+        if kind == "special":
+            ret.append(_special_text(span, entry[2], entry[3], entry[4]))
+        elif kind == "correction":
+            ret.append(_correction(span, entry[2]))
+        elif kind == "text":
+            ret.append(_clone_text(span, entry[2]))
+        else:
+            ret.append(span)
+    return ret
 
 
 def _clone_text(text_node, new_text):
     t = text.Text()
     t.style = text_node.style
+    t.source = text_node.source
     t.text = new_text
     return t
 
@@ -255,24 +949,26 @@ def _clone_text(text_node, new_text):
 def _special_text(text_node, new_text, html, is_whitespace):
     t = text.SpecialCharacter()
     t.style = text_node.style
+    t.source = text_node.source
     t.text = new_text
     t.html = html
     t.is_whitespace = is_whitespace
     return t
 
 
+def _correction(text_node, original):
+    t = text.Correction(original)
+    t.style = text_node.style
+    t.source = text_node.source
+    return t
+
+
 def _join_text(ret, text_node, val):
     if len(val) > 0:
         ret.append(_clone_text(text_node, val))
     return ""
 
 
-def _has_trailing_whitespace(parsed):
-    if len(parsed) <= 0:
-        return True
-    return parsed[-1].isspace()
-
-
 def _strip_trailing_whitespace(spans, val):
     if val.rstrip() == "" and len(spans) > 0:
         while len(spans) > 0:
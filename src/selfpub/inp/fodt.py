@@ -0,0 +1,128 @@
+"""
+Flat ODT (.fodt) input file parser.
+
+A flat ODT file is the whole document as a single XML file, rather than
+a zip package.
+"""
+
+from .inpf import InputFile
+from .odt import (
+    ODTInputFile, ContentFile, MetaFile, OdtStyleSet, ElementStream)
+from .. import text
+
+
+# Parts of the flat file, before the body, that are loaded as styles.
+FLAT_STYLE_TAGS = (
+    "office:font-face-decls",
+    "office:styles",
+    "office:automatic-styles",
+    "office:master-styles",
+)
+FLAT_META_TAG = "office:meta"
+
+
+class FlatODTInputFile(ODTInputFile):
+    """
+    Reads a flat ODT file.  The file is read in a single forward pass, and
+    is never loaded as a whole: opening it reads the meta data and styles,
+    which come before the body, and sections() reads the body as it goes.
+    Because of that, the sections can only be read once.
+
+    Images embedded in the XML are read as odt.EmbeddedImage objects;
+    linked images are not supported.
+
+    The file stays open until the sections have been read to the end; call
+    close() when they are not.
+    """
+    def __init__(self, filename, cover_image_file, coalesce_spans=True,
+                 lazy_paras=False):
+        InputFile.__init__(self)
+        self.odt = FlatODT(filename, lazy_paras)
+        self.set_options(cover_image_file, lazy_paras=lazy_paras,
+                         coalesce_spans=coalesce_spans)
+
+
+class FlatODT(object):
+    """The same parts as an ODT, for a flat file."""
+    def __init__(self, filename, lazy_paras=False):
+        object.__init__(self)
+        self.low = None
+        self.meta = MetaFile(None)
+        self.content = FlatContentFile(filename, self.meta, lazy_paras)
+
+    def close(self):
+        self.content.close()
+
+
+class FlatContentFile(ContentFile):
+    """
+    The content of a flat file.  The meta data and styles are loaded when
+    it is created, and the file is left open at the start of the body until
+    stream() is read to the end, or close() is called.
+
+    As the body is read in the same pass, `lazy_paras` (see
+    ContentFile.stream()) must be chosen up front.
+    """
+    def __init__(self, filename, meta, lazy_paras=False):
+        self.__styles = OdtStyleSet()
+        ContentFile.__init__(self, None, self.__styles)
+        self.lazy_paras = lazy_paras
+        self.__file = open(filename, "rb")
+        if lazy_paras:
+            elements = ElementStream(
+                self.__file, FLAT_STYLE_TAGS + (FLAT_META_TAG,), (),
+                ("office:text",))
+        else:
+            elements = ElementStream(
+                self.__file, FLAT_STYLE_TAGS + (FLAT_META_TAG,),
+                ("office:text",))
+        self.__elements = elements.elements()
+        self.__first = None
+
+        # Read until the first body element.
+        for element in self.__elements:
+            parent, child, line, offset = element
+            if parent == "office:text":
+                self.__first = element
+                break
+            elif child.tagName == FLAT_META_TAG:
+                meta.properties.update(meta.parse_meta_element(child))
+            else:
+                self.__styles.load_from_xml(child)
+        if self.__first is None:
+            self.close()
+
+    def close(self):
+        self.__first = None
+        self.__file.close()
+
+    def get_content_dom(self):
+        raise Exception("Flat ODT files can only be streamed")
+
+    def convert(self):
+        return self.stream(self.lazy_paras)
+
+    def stream(self, lazy_paras=False):
+        if lazy_paras != self.lazy_paras:
+            raise Exception("flat file was opened with lazy_paras={0}".format(
+                self.lazy_paras))
+        if self.__first is None:
+            return
+        first = self.__first
+        self.__first = None
+        try:
+            ordinal = 0
+            for parent, child, line, offset in _chain(first, self.__elements):
+                if parent == "office:text":
+                    ordinal += 1
+                    source = text.Provenance(ordinal, line, offset, None)
+                    for v in self.convert_element(child, source):
+                        yield v
+        finally:
+            self.close()
+
+
+def _chain(first, rest):
+    yield first
+    for v in rest:
+        yield v
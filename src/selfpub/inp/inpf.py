@@ -99,7 +99,7 @@ class InputVisitor(InputFile):
             self.exit_div(sec, depth)
         elif isinstance(sec, text.Text):
             div = text.Para()
-            div.spans.append(sec)
+            div.add_span(sec)
             self.enter_div(div, depth)
             self.enter_span(sec, div)
             self.exit_span(sec, div)
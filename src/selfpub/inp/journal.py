@@ -0,0 +1,139 @@
+"""
+A journal of the corrections made by the Cleaner.
+"""
+
+import bisect
+import collections
+import json
+from .cleaner import iter_paras
+from .. import text
+
+
+JournalEntry = collections.namedtuple('JournalEntry', (
+    'paragraph', 'offset', 'original'))
+
+
+class CorrectionJournal(object):
+    """
+    An append-only record of the corrections the Cleaner made, used in
+    place of text.Correction spans.  Each entry is the paragraph number,
+    the offset of the correction in the cleaned text of the paragraph, and
+    the original text.
+
+    The Cleaner sees the paragraphs before the style sheet puts them into
+    chapters, so the entries don't record a chapter; use section() with the
+    chapter to get its entries.
+
+    With a `filename`, the entries are written to that file as they are
+    added, one JSON list per line, and are not kept in memory; use
+    load_journal() to read them back.  Without one, the entries are kept in
+    memory, in paragraph and offset order, and can be queried.  The summary
+    counts are kept either way.
+    """
+    def __init__(self, filename=None):
+        object.__init__(self)
+        self.filename = filename
+        self.count = 0
+        # original text -> number of corrections
+        self.original_counts = collections.Counter()
+        self.__entries = []
+        # (paragraph, offset) of each entry, for bisect.
+        self.__keys = []
+        self.__out = None
+
+    @property
+    def in_memory(self):
+        return self.filename is None
+
+    def append(self, paragraph, offset, original):
+        entry = JournalEntry(paragraph, offset, original)
+        self.count += 1
+        self.original_counts[original] += 1
+        if self.filename is not None:
+            if self.__out is None:
+                self.__out = open(self.filename, "a", encoding="utf-8")
+            self.__out.write(json.dumps(entry, ensure_ascii=False))
+            self.__out.write("\n")
+            return
+        key = (paragraph, offset)
+        if len(self.__keys) > 0 and key < self.__keys[-1]:
+            # Only happens with paragraph numbers from the input that are
+            # out of order.
+            index = bisect.bisect_right(self.__keys, key)
+            self.__keys.insert(index, key)
+            self.__entries.insert(index, entry)
+        else:
+            self.__keys.append(key)
+            self.__entries.append(entry)
+
+    def entries(self):
+        """All the entries, in paragraph and offset order."""
+        self.__check_in_memory()
+        return list(self.__entries)
+
+    def paragraph(self, paragraph):
+        """The entries for the paragraph."""
+        return self.paragraphs(paragraph, paragraph + 1)
+
+    def paragraphs(self, first, last):
+        """The entries for the paragraphs numbered from `first` up to, but
+        not including, `last`."""
+        self.__check_in_memory()
+        start = bisect.bisect_left(self.__keys, (first,))
+        end = bisect.bisect_left(self.__keys, (last,))
+        return self.__entries[start:end]
+
+    def section(self, sec):
+        """
+        The entries for the paragraphs in the section, such as a Chapter
+        built by the style sheet after cleaning; this is how to get the
+        corrections of a chapter.  This relies on the paragraphs having a
+        text.Provenance source, which gives their paragraph numbers.
+        """
+        first = None
+        last = None
+        for para in iter_paras(sec):
+            if isinstance(para.source, text.Provenance):
+                num = para.source.paragraph
+                if first is None or num < first:
+                    first = num
+                if last is None or num > last:
+                    last = num
+        if first is None:
+            return []
+        return self.paragraphs(first, last + 1)
+
+    def summary(self):
+        return {
+            "corrections": self.count,
+            "paragraphs": len(set(k[0] for k in self.__keys)) if self.in_memory else None,
+            "originals": dict(self.original_counts),
+        }
+
+    def flush(self):
+        if self.__out is not None:
+            self.__out.flush()
+
+    def close(self):
+        if self.__out is not None:
+            self.__out.close()
+            self.__out = None
+
+    def __len__(self):
+        return self.count
+
+    def __check_in_memory(self):
+        if self.filename is not None:
+            raise Exception("journal {0} is not kept in memory; use load_journal()".format(
+                self.filename))
+
+
+def load_journal(filename):
+    """Read a journal file into an in-memory CorrectionJournal."""
+    ret = CorrectionJournal()
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) > 0:
+                ret.append(*json.loads(line))
+    return ret
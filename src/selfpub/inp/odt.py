@@ -2,19 +2,90 @@
 ODT input file parser.
 """
 
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import pickle
+import re
+import types
 import zipfile
 import xml.dom
 import xml.dom.minidom
+import xml.parsers.expat
 from io import StringIO
 from .inpf import InputFile
+from .zipio import STREAM_CHUNK_SIZE, MappedZip, PrefetchStream
 from .. import text
 
 
+# Number of top-level elements handed to a worker process at a time.
+PARALLEL_CHUNK_SIZE = 200
+
+# Change this whenever the parsed output changes, so that cached parse
+# results are not used.
+PARSER_VERSION = "3"
+
+
 class ODTInputFile(InputFile):
-    def __init__(self, filename, cover_image_file):
+    """
+    Reads an ODT file.  By default, adjacent text spans in a paragraph that
+    have the same style are joined together (LibreOffice splits the text into
+    many small spans); set `coalesce_spans` to False to keep the spans as
+    they are in the document.
+
+    With a `cache` (a cache.ParseCache), the parsed sections are stored
+    under a hash of the content and styles, and when the same document is
+    read again, the XML is not parsed at all.  Note that on a cache miss,
+    the sections are held in memory until all have been read.
+
+    With `prefetch`, the meta, styles and content files are decompressed
+    by background threads while the earlier ones are parsed (see
+    LowODF.prefetch()).  This has no effect in lazy mode.  The prefetching
+    stops when the sections have been read; if they are not read, call
+    close().
+
+    With `use_mmap`, the package file is memory mapped, and the images are
+    copied out of it without being read into memory (see MappedZip).
+
+    With `lazy_paras` (streaming mode only, and not with `parallel`),
+    plain paragraphs are returned as LazyPara objects, which keep the raw
+    XML and only parse the spans when they are used.
+
+    close() closes the file; do so once the output, which copies the
+    images out of it, has been written.
+    """
+    def __init__(self, filename, cover_image_file, streaming=True, lazy=False,
+                 coalesce_spans=True, parallel=False, workers=None,
+                 chunk_size=PARALLEL_CHUNK_SIZE, cache=None, prefetch=False,
+                 use_mmap=False, lazy_paras=False):
         InputFile.__init__(self)
-        self.odt = parse_file(filename)
+        self.odt = parse_file(filename, lazy or cache is not None, prefetch,
+                              use_mmap)
+        self.set_options(cover_image_file, streaming, lazy_paras,
+                         coalesce_spans, parallel, workers, chunk_size, cache)
+
+    def set_options(self, cover_image_file, streaming=True, lazy_paras=False,
+                    coalesce_spans=True, parallel=False, workers=None,
+                    chunk_size=PARALLEL_CHUNK_SIZE, cache=None):
+        """Set the reading options; used by subclasses that load `odt`
+        some other way."""
+        if parallel and lazy_paras:
+            # The point of the worker processes is to parse the spans.
+            raise Exception("lazy_paras can't be used with parallel parsing")
         self.cover_image_file = cover_image_file
+        self.streaming = streaming
+        self.lazy_paras = lazy_paras
+        self.coalesce_spans = coalesce_spans
+        self.parallel = parallel
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+
+    def close(self):
+        self.odt.close()
 
     def get_metadata(self):
         ret = text.MetaData()
@@ -57,32 +128,120 @@ class ODTInputFile(InputFile):
     
     def sections(self):
         """Iterator to read sections in the input.  Should use 'yield'"""
-        for ret in self.odt.content.convert():
+        for ret in self.read_sections():
+            yield ret
+        if self.odt.low is not None:
+            # Anything still being prefetched will not be read.
+            self.odt.low.cancel_prefetch()
+
+    def read_sections(self):
+        """The sections, from the cache if there is one."""
+        if self.cache is None:
+            for ret in self.parse_sections():
+                yield ret
+            return
+
+        key = self.get_cache_key()
+        data = self.cache.get(key)
+        if data is not None:
+            try:
+                found = loads_text(data, self.odt.low)
+            except Exception as e:
+                # A damaged entry, or one written by other code.
+                print("** Ignoring bad parse cache entry {0}: {1!r}".format(key, e))
+                self.cache.remove(key)
+                found = None
+            if found is not None:
+                for ret in found:
+                    yield ret
+                return
+        found = []
+        for ret in self.parse_sections():
+            found.append(ret)
+            yield ret
+        self.cache.put(key, dumps_text(found))
+
+    def get_cache_key(self):
+        """Hash of everything that the parsed sections depend upon."""
+        ret = hashlib.sha256()
+        # The sources of the streamed sections have the line and offset of
+        # each element, which the DOM doesn't give.
+        mode = "dom"
+        if self.parallel or self.streaming:
+            mode = "stream"
+        ret.update("{0}/{1}/{2}".format(PARSER_VERSION, self.coalesce_spans, mode).encode())
+        for name in (CONTENT_FILE, STYLE_FILE):
+            ret.update(b"\0" + name.encode() + b"\0")
+            if self.odt.low.has_file(name):
+                inp = self.odt.low.open_file(name)
+                try:
+                    while True:
+                        data = inp.read(STREAM_CHUNK_SIZE)
+                        if len(data) <= 0:
+                            break
+                        ret.update(data)
+                finally:
+                    inp.close()
+        return ret.hexdigest()
+
+    def parse_sections(self):
+        """Parse the sections out of the document."""
+        if self.parallel:
+            sections = self.odt.content.stream_parallel(self.workers, self.chunk_size)
+        elif self.streaming:
+            sections = self.odt.content.stream(self.lazy_paras)
+        else:
+            sections = self.odt.content.convert()
+        for ret in sections:
+            if self.coalesce_spans:
+                coalesce_spans(ret)
             yield ret
 
 
-def parse_file(filename):
-    return parse_zip(zipfile.ZipFile(filename, 'r'))
+def parse_file(filename, lazy=False, prefetch=False, use_mmap=False):
+    return parse_zip(zipfile.ZipFile(filename, 'r'), lazy, prefetch, use_mmap)
 
 
-def parse_contents(contents):
+def parse_contents(contents, lazy=False, prefetch=False):
     sfile = StringIO(contents)
-    return parse_zip(zipfile.ZipFile(sfile, 'r'))
+    return parse_zip(zipfile.ZipFile(sfile, 'r'), lazy, prefetch)
 
 
-def parse_zip(zipf):
-    return ODT(zipf)
+def parse_zip(zipf, lazy=False, prefetch=False, use_mmap=False):
+    return ODT(zipf, lazy, prefetch, use_mmap)
 
 
 class ODT(object):
-    def __init__(self, zipf):
+    """
+    The parts of an ODT package.  In lazy mode only the meta data is read
+    up front; the content and styles are not read until `content` is first
+    used.
+
+    With `prefetch` (and not lazy), the files are decompressed in the
+    background, in the order they are parsed.
+    """
+    def __init__(self, zipf, lazy=False, prefetch=False, use_mmap=False):
         object.__init__(self)
-        self.low = LowODF(zipf)
+        self.low = LowODF(zipf, use_mmap)
         assert self.low.has_file(MANIFEST_FILE)
         assert self.low.has_file(CONTENT_FILE)
         assert self.low.has_file(META_FILE)
+        if prefetch and not lazy:
+            # In lazy mode, the content may never be read.
+            self.low.prefetch((META_FILE, STYLE_FILE, CONTENT_FILE))
         self.meta = MetaFile(self.low)
-        self.content = ContentFile(self.low)
+        self.__content = None
+        if not lazy:
+            self.__content = ContentFile(self.low)
+
+    @property
+    def content(self):
+        if self.__content is None:
+            self.__content = ContentFile(self.low)
+        return self.__content
+
+    def close(self):
+        self.low.close()
     
 
 MANIFEST_FILE = "META-INF/manifest.xml"
@@ -92,46 +251,310 @@ META_FILE = "meta.xml"
 
 
 class LowODF(object):
-    def __init__(self, zipf):
+    def __init__(self, zipf, use_mmap=False):
         object.__init__(self)
         self.__zip = zipf
+        # None if the package was not opened from a file.
+        self.filename = zipf.filename
         self.__files = {}
         for info in self.__zip.infolist():
             self.__files[info.orig_filename] = info
+        self.__prefetched = {}
+        # Every prefetch stream, including those that have been opened.
+        self.__prefetch_streams = []
+        self.__mapped = None
+        if use_mmap and self.filename is not None:
+            self.__mapped = MappedZip(self.filename, self.__files)
 
     def has_file(self, name):
         return name in self.__files.keys()
 
+    def prefetch(self, names):
+        """
+        Start decompressing the files on a small thread pool (zlib does not
+        hold the GIL while it works), so that they are ready by the time
+        they are read.  The next read_file() or open_file() of each name
+        uses the prefetched data; open_file() returns the stream as it is
+        being decompressed, so the parser can start on a large file while
+        the earlier files are still being read.
+
+        Only a few chunks of each file are read ahead.
+        """
+        names = [name for name in names
+                 if self.has_file(name) and name not in self.__prefetched]
+        if len(names) <= 0:
+            return
+        pool = concurrent.futures.ThreadPoolExecutor(
+            len(names), thread_name_prefix="odt-prefetch")
+        try:
+            for name in names:
+                stream = PrefetchStream(self.__open(name))
+                self.__prefetched[name] = stream
+                self.__prefetch_streams.append(stream)
+                pool.submit(stream.fill)
+        finally:
+            # The submitted work still runs.
+            pool.shutdown(wait=False)
+
+    def cancel_prefetch(self):
+        """Stop any prefetching that has not been read."""
+        for stream in self.__prefetched.values():
+            stream.close()
+        self.__prefetched = {}
+
+    def close(self):
+        """Stop any prefetching, even of files that are being read, and
+        close the package.  Images from it can no longer be saved."""
+        self.cancel_prefetch()
+        for stream in self.__prefetch_streams:
+            stream.close()
+        self.__prefetch_streams = []
+        if self.__mapped is not None:
+            self.__mapped.close()
+            self.__mapped = None
+        self.__zip.close()
+
     def read_file(self, name):
-        return self.__zip.read(name)
+        stream = self.__prefetched.pop(name, None)
+        if stream is None:
+            return self.__zip.read(name)
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+    def open_file(self, name):
+        """Open the file as a stream of decompressed bytes."""
+        stream = self.__prefetched.pop(name, None)
+        if stream is not None:
+            return stream
+        return self.__open(name)
+
+    def __open(self, name):
+        if self.__mapped is not None:
+            stream = self.__mapped.open_file(name)
+            if stream is not None:
+                return stream
+        return self.__zip.open(name)
+
+    def get_file_view(self, name):
+        """A memoryview of the file's bytes, without copying them, or None
+        if the package is not memory mapped or the file is compressed."""
+        if self.__mapped is None:
+            return None
+        return self.__mapped.get_file_view(name)
+
+    def get_file_size(self, name):
+        """The uncompressed size of the file."""
+        return self.__files[name].file_size
+
+    def copy_file(self, name, dest_stream, chunk_size=STREAM_CHUNK_SIZE):
+        """Write the file's contents into the stream, a chunk at a time."""
+        view = self.get_file_view(name)
+        if view is not None:
+            for pos in range(0, len(view), chunk_size):
+                dest_stream.write(view[pos:pos + chunk_size])
+            return
+        inp = self.open_file(name)
+        try:
+            while True:
+                data = inp.read(chunk_size)
+                if len(data) <= 0:
+                    break
+                dest_stream.write(data)
+        finally:
+            inp.close()
 
     def read_dom(self, name):
         return xml.dom.minidom.parseString(self.read_file(name))
 
 
+class ElementStream(object):
+    """
+    Event-driven XML reader.  The stream is fed through expat in fixed size
+    chunks, and only the elements named in `expand`, or whose parent is named
+    in `expand_children`, are built into (detached) DOM elements.  Each one
+    is handed out as soon as its closing tag is read and is not referenced
+    afterwards, so memory use does not depend on the size of the document.
+
+    Children of the elements named in `raw_children` are not parsed into a
+    DOM at all; instead, their raw XML bytes are handed out.  These can be
+    turned into a DOM element later with parse_fragment().
+
+    The DOM elements use the qualified tag and attribute names
+    ("text:p", "text:style-name"), the same as the parsed documents.
+    """
+    def __init__(self, stream, expand=(), expand_children=(), raw_children=(),
+                 chunk_size=STREAM_CHUNK_SIZE):
+        object.__init__(self)
+        self.stream = stream
+        self.expand = expand
+        self.expand_children = expand_children
+        self.raw_children = raw_children
+        self.chunk_size = chunk_size
+        self.__doc = xml.dom.minidom.Document()
+        self.__parser = None
+        self.__tags = []
+        self.__building = []
+        self.__position = None
+        self.__ready = []
+
+        # Raw element handling.  The buffer holds the stream bytes from
+        # __buffer_start on.
+        self.__buffer = bytearray()
+        self.__buffer_start = 0
+        self.__raw_depth = 0
+        self.__raw_start = None
+        self.__raw_empty = False
+        self.__last_event = 0
+
+    def elements(self):
+        """Iterate over (parent tag name, DOM element, line number, byte
+        offset) for each expanded element, in document order.  The line
+        number and offset are where the element starts.  For raw elements,
+        the DOM element is replaced by the element's bytes."""
+        parser = xml.parsers.expat.ParserCreate()
+        self.__parser = parser
+        parser.buffer_text = True
+        parser.StartElementHandler = self.__start_element
+        parser.EndElementHandler = self.__end_element
+        parser.CharacterDataHandler = self.__character_data
+        while True:
+            data = self.stream.read(self.chunk_size)
+            if len(self.raw_children) > 0:
+                self.__buffer += data
+            parser.Parse(data, len(data) <= 0)
+            while len(self.__ready) > 0:
+                yield self.__ready.pop(0)
+            if len(data) <= 0:
+                break
+            if len(self.raw_children) > 0:
+                self.__trim_buffer()
+
+    def __trim_buffer(self):
+        # Keep everything that an unfinished raw element, or an unfinished
+        # tag at the end of the data, may need.
+        keep = self.__last_event
+        if self.__raw_start is not None:
+            keep = min(keep, self.__raw_start)
+        if keep > self.__buffer_start:
+            del self.__buffer[:keep - self.__buffer_start]
+            self.__buffer_start = keep
+
+    def __start_element(self, name, attrs):
+        self.__last_event = self.__parser.CurrentByteIndex
+        self.__raw_empty = False
+        if self.__raw_depth > 0:
+            self.__raw_depth += 1
+        elif len(self.__building) <= 0 and len(self.__tags) > 0 and self.__tags[-1] in self.raw_children:
+            self.__raw_depth = 1
+            self.__raw_start = self.__parser.CurrentByteIndex
+            self.__raw_empty = True
+            self.__position = (
+                self.__parser.CurrentLineNumber, self.__parser.CurrentByteIndex)
+        elif len(self.__building) > 0 or name in self.expand or (
+                len(self.__tags) > 0 and self.__tags[-1] in self.expand_children):
+            if len(self.__building) <= 0:
+                self.__position = (
+                    self.__parser.CurrentLineNumber, self.__parser.CurrentByteIndex)
+            node = self.__doc.createElement(name)
+            for key, val in attrs.items():
+                node.setAttribute(key, val)
+            self.__building.append(node)
+        self.__tags.append(name)
+
+    def __end_element(self, name):
+        self.__last_event = self.__parser.CurrentByteIndex
+        self.__tags.pop()
+        if self.__raw_depth > 0:
+            self.__raw_depth -= 1
+            if self.__raw_depth <= 0:
+                self.__end_raw()
+        elif len(self.__building) > 0:
+            node = self.__building.pop()
+            if len(self.__building) > 0:
+                # Only attach the element when it is complete; the DOM walks
+                # up through all the parent nodes on every change to an
+                # attached node.
+                self.__building[-1].appendChild(node)
+            else:
+                parent = None
+                if len(self.__tags) > 0:
+                    parent = self.__tags[-1]
+                self.__ready.append((parent, node) + self.__position)
+
+    def __end_raw(self):
+        index = self.__parser.CurrentByteIndex - self.__buffer_start
+        if self.__raw_empty and self.__buffer[index - 2:index] == b'/>':
+            # An empty element tag; the index is just after it.
+            end = index
+        else:
+            # The index is the start of the end tag.
+            end = self.__buffer.index(b'>', index) + 1
+        raw = bytes(self.__buffer[self.__raw_start - self.__buffer_start:end])
+        self.__raw_start = None
+        self.__raw_empty = False
+        self.__ready.append((self.__tags[-1], raw) + self.__position)
+
+    def __character_data(self, data):
+        self.__raw_empty = False
+        if len(self.__building) > 0:
+            parent = self.__building[-1]
+            if (len(parent.childNodes) > 0 and
+                    parent.childNodes[-1].nodeType == xml.dom.Node.TEXT_NODE):
+                # Join with the previous text, as the DOM parser does.
+                parent.childNodes[-1].data += data
+            else:
+                parent.appendChild(self.__doc.createTextNode(data))
+
+
+FRAGMENT_TAG = "fragment"
+
+
+def parse_fragment(raw):
+    """Parse the raw bytes of a single element, as returned by
+    ElementStream for raw elements, into a DOM element."""
+    stream = io.BytesIO(b"<" + FRAGMENT_TAG.encode() + b">" + raw +
+                        b"</" + FRAGMENT_TAG.encode() + b">")
+    for parent, node, line, offset in ElementStream(stream, (), (FRAGMENT_TAG,)).elements():
+        return node
+    raise Exception("No element in fragment {0!r}".format(raw))
+
+
 class MetaFile(object):
     def __init__(self, lowodf):
         object.__init__(self)
-        self.properties = self.parse_meta(
-            lowodf.read_dom(META_FILE))
-
-    def parse_meta(self, dom):
+        if lowodf is None:
+            # Filled in by the caller.
+            self.properties = {}
+        else:
+            inp = lowodf.open_file(META_FILE)
+            try:
+                self.properties = self.parse_meta_stream(inp)
+            finally:
+                inp.close()
+
+    def parse_meta_element(self, metaset):
+        """Read the properties from an <office:meta> element."""
         ret = {}
-        for metaset in dom.getElementsByTagName("office:meta"):
-            for child in metaset.childNodes:
-                if child.nodeType == xml.dom.Node.ELEMENT_NODE:
-                    if child.tagName[:3] == 'dc:':
-                        ret[child.tagName[3:]] = self.get_node_text(child)
-                    elif child.tagName == 'meta:user-defined':
-                        ret[child.getAttribute("meta:name")] = self.get_node_text(child)
-                        pass
-                    elif child.tagName == 'meta:document-statistic':
-                        # ignore
-                        pass
-                    elif child.tagName[:5] == 'meta:':
-                        ret[child.tagName[5:]] = self.get_node_text(child)
+        for child in metaset.childNodes:
+            if child.nodeType == xml.dom.Node.ELEMENT_NODE:
+                key = get_meta_key(child.tagName, child.getAttribute("meta:name"))
+                if key is not None:
+                    ret[key] = self.get_node_text(child)
         return ret
 
+    def parse_meta_stream(self, stream):
+        """Read the properties from the meta file's XML stream, with expat
+        rather than a DOM."""
+        handler = MetaHandler()
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = handler.start_element
+        parser.EndElementHandler = handler.end_element
+        parser.CharacterDataHandler = handler.character_data
+        parser.ParseFile(stream)
+        return handler.properties
+
     def get_node_text(self, node):
         ret = ""
         for child in node.childNodes:
@@ -139,32 +562,102 @@ class MetaFile(object):
                     child.nodeType == xml.dom.Node.CDATA_SECTION_NODE):
                 ret = ret + child.data
         return ret
-        
+
+
+def get_meta_key(tag, user_defined_name):
+    """The properties key for the tag of an <office:meta> child element,
+    or None if it is ignored."""
+    if tag[:3] == 'dc:':
+        return tag[3:]
+    elif tag == 'meta:user-defined':
+        return user_defined_name
+    elif tag == 'meta:document-statistic':
+        # ignore
+        return None
+    elif tag[:5] == 'meta:':
+        return tag[5:]
+    return None
+
+
+class MetaHandler(object):
+    """expat handler that collects the <office:meta> properties."""
+    def __init__(self):
+        object.__init__(self)
+        self.properties = {}
+        self.__tags = []
+        self.__key = None
+        self.__key_depth = 0
+        self.__text = []
+
+    def start_element(self, name, attrs):
+        if self.__key is None and len(self.__tags) > 0 and self.__tags[-1] == "office:meta":
+            self.__key = get_meta_key(name, attrs.get("meta:name", ""))
+            self.__key_depth = len(self.__tags)
+            self.__text = []
+        self.__tags.append(name)
+
+    def end_element(self, name):
+        self.__tags.pop()
+        if self.__key is not None and len(self.__tags) == self.__key_depth:
+            self.properties[self.__key] = "".join(self.__text)
+            self.__key = None
+
+    def character_data(self, data):
+        # Only the text directly inside the property element is used.
+        if self.__key is not None and len(self.__tags) == self.__key_depth + 1:
+            self.__text.append(data)
+
 
 STYLE_ATTRIBUTES = (
     "text:style-name",
     # "style:data-style-name",
 )
 
+# Parts of the content file, before the body, that define styles.
+CONTENT_STYLE_TAGS = (
+    "office:font-face-decls",
+    "office:automatic-styles",
+)
+
+# Top-level body elements that are converted into text.
+TEXT_PREFIXES = (
+    "draw",
+    "text",
+)
+
 
 class ContentFile(object):
-    def __init__(self, lowodf):
+    def __init__(self, lowodf, styles=None):
         object.__init__(self)
         self.lowodf = lowodf
-        self.__content = lowodf.read_dom(CONTENT_FILE)
-        self.__styles = OdtStyleSet()
+        self.__content = None
         self.__text = None
-        if lowodf.has_file(STYLE_FILE):
-            self.__styles.load_from_xml(lowodf.read_dom(STYLE_FILE))
-        self.__styles.load_from_xml(self.__content)
-        
+        if styles is not None:
+            self.__styles = styles
+        else:
+            self.__styles = OdtStyleSet()
+            if lowodf.has_file(STYLE_FILE):
+                inp = lowodf.open_file(STYLE_FILE)
+                try:
+                    self.__styles.load_from_stream(inp)
+                finally:
+                    inp.close()
+
+    def get_content_dom(self):
+        """Return the whole content file as a DOM.  This is only loaded
+        on demand; stream() does not need it."""
+        if self.__content is None:
+            self.__content = self.lowodf.read_dom(CONTENT_FILE)
+            self.__styles.load_from_xml(self.__content)
+        return self.__content
+
     def get_text_dom(self):
         """Return a list of all top-level text nodes found in
         <office:body><office:text> parts"""
         
         if self.__text is None:
             self.__text = []
-            for section in self.__content.getElementsByTagName("office:text"):
+            for section in self.get_content_dom().getElementsByTagName("office:text"):
                 if section.nodeType == xml.dom.Node.ELEMENT_NODE:
                     for child in section.childNodes:
                         if (child.nodeType == xml.dom.Node.ELEMENT_NODE and
@@ -189,7 +682,7 @@ class ContentFile(object):
     def parse_text(self):
         """Iterate over the text nodes, returning BaseText objects."""
         for text_node in self.get_text_dom():
-            val = parse_node(text_node, self, [])
+            val = parse_node(text_node, self)
             if val is not None:
                 for node in val:
                     yield node
@@ -200,21 +693,131 @@ class ContentFile(object):
 
         :return: iterable of text nodes, which should all be divs.
         """
-        for section in self.__content.getElementsByTagName("office:text"):
+        ordinal = 0
+        for section in self.get_content_dom().getElementsByTagName("office:text"):
             if section.nodeType == xml.dom.Node.ELEMENT_NODE:
                 for child in section.childNodes:
-                    val = None
                     if child.nodeType == xml.dom.Node.ELEMENT_NODE:
-                        if child.prefix == "draw" or child.prefix == "text":
-                            val = parse_node(child, self)
-                        else:
-                            print("Unknown child prefix {0}".format(child.toxml()))
-                    if val is not None:
-                        if isinstance(val, list):
-                            for v in val:
-                                yield v
-                        else:
-                            yield val
+                        ordinal += 1
+                        source = text.Provenance(ordinal, None, None, None)
+                        for v in self.convert_node(child, source):
+                            yield v
+
+    def stream(self, lazy_paras=False):
+        """
+        Event-driven version of convert().  The content file is read through
+        expat, and each top-level <office:text> child is converted as soon as
+        it closes, then dropped, so the whole document is never loaded.  The
+        styles stored in the content file come before the body, and are
+        loaded as they are passed.
+
+        The text nodes do not keep any reference to the XML; their source is
+        a text.Provenance with the position of the top-level element in
+        the content file.
+
+        With `lazy_paras`, the top-level elements are read as raw XML, and
+        the plain paragraphs are returned as LazyPara objects, which hold on
+        to their XML until the spans are needed.
+
+        :return: iterable of text nodes, which should all be divs.
+        """
+        inp = self.lowodf.open_file(CONTENT_FILE)
+        try:
+            if lazy_paras:
+                elements = ElementStream(inp, CONTENT_STYLE_TAGS, (), ("office:text",))
+            else:
+                elements = ElementStream(inp, CONTENT_STYLE_TAGS, ("office:text",))
+            ordinal = 0
+            for parent, child, line, offset in elements.elements():
+                if parent != "office:text":
+                    self.__styles.load_from_xml(child)
+                    continue
+                ordinal += 1
+                source = text.Provenance(ordinal, line, offset, None)
+                for v in self.convert_element(child, source):
+                    yield v
+        finally:
+            inp.close()
+
+    def convert_element(self, element, source):
+        """Convert a top-level element from an ElementStream.  Raw elements
+        are returned as a LazyPara when they are plain paragraphs."""
+        if not isinstance(element, bytes):
+            return self.convert_node(element, source)
+        if is_lazy_para(element):
+            return [LazyPara(element, self, source)]
+        return self.convert_node(parse_fragment(element), source)
+
+    def stream_parallel(self, workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+        """
+        Parallel version of stream().  The content file is split into the
+        raw XML of the top-level <office:text> children, which are sent in
+        groups of `chunk_size` to a pool of `workers` processes (by default,
+        one per CPU) along with the resolved styles.  The text nodes are
+        returned in document order; only a few groups per worker are in
+        progress at a time.
+
+        The package must have been opened from a file, so that the workers
+        can open it; otherwise this is the same as stream().
+
+        :return: iterable of text nodes, which should all be divs.
+        """
+        if self.lowodf.filename is None:
+            print("Package is not a file; not parsing with worker processes")
+            for v in self.stream():
+                yield v
+            return
+        if workers is None:
+            workers = os.cpu_count() or 1
+        inp = self.lowodf.open_file(CONTENT_FILE)
+        pool = None
+        pending = collections.deque()
+        chunk = []
+        try:
+            elements = ElementStream(inp, CONTENT_STYLE_TAGS, (), ("office:text",))
+            ordinal = 0
+            for parent, child, line, offset in elements.elements():
+                if parent != "office:text":
+                    self.__styles.load_from_xml(child)
+                    continue
+                ordinal += 1
+                chunk.append((ordinal, line, offset, child))
+                if len(chunk) >= chunk_size:
+                    if pool is None:
+                        # The styles are all loaded by the time the body
+                        # starts.
+                        pool = concurrent.futures.ProcessPoolExecutor(
+                            workers, initializer=_init_parse_worker,
+                            initargs=(self.lowodf.filename, self.__styles))
+                    pending.append(pool.submit(_parse_chunk, chunk))
+                    chunk = []
+                    while len(pending) > workers * 2:
+                        for v in loads_text(pending.popleft().result(), self.lowodf):
+                            yield v
+            while len(pending) > 0:
+                for v in loads_text(pending.popleft().result(), self.lowodf):
+                    yield v
+            # Not worth handing the last, partial chunk to a worker.
+            for v in loads_text(_parse_chunk(chunk, self), self.lowodf):
+                yield v
+        finally:
+            inp.close()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def convert_node(self, child, source=None):
+        """Convert a single top-level <office:text> child element into a list
+        of text nodes.  `source` is the text.Provenance of the element."""
+        val = None
+        if child.tagName.split(':')[0] in TEXT_PREFIXES:
+            val = parse_node(child, self, None, source)
+        else:
+            print("Unknown child prefix {0}".format(child.toxml()))
+        if val is None:
+            return []
+        if isinstance(val, list):
+            return val
+        return [val]
 
 
 PARAGRAPH_STYLE_ATTRIBUTES = {
@@ -258,22 +861,55 @@ FONT_TAGS = (
 
 
 class OdtStyleSet(object):
+    """
+    All the styles and fonts for a document.  Each time styles are loaded,
+    the inheritance of every style is resolved into a flat ResolvedStyle, so
+    that looking up a style is a single dictionary access.
+    """
     def __init__(self):
         object.__init__(self)
         self.__styles = {}
+        self.__resolved = {}
         self.__fonts = {}
+
+    def __getstate__(self):
+        # Only the resolved styles are passed on; the source styles keep
+        # their XML.
+        return {'resolved': self.__resolved, 'fonts': self.__fonts}
+
+    def __setstate__(self, state):
+        self.__styles = {}
+        self.__resolved = state['resolved']
+        self.__fonts = state['fonts']
         
     def get_style_by_name(self, name):
-        if name in self.__styles:
-            ret = self.__styles[name]
-            ret.load_parent(self)
-            return ret
-        return None
+        return self.__resolved.get(name)
     
     def get_font_by_name(self, name):
         if name in self.__fonts:
             return self.__fonts[name]
         return None
+
+    def load_from_stream(self, stream):
+        """Same as load_from_xml, but reads the XML stream in a single
+        pass with expat rather than building a DOM."""
+        handler = StyleHandler()
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = handler.start_element
+        parser.EndElementHandler = handler.end_element
+        parser.ParseFile(stream)
+
+        # Same order as load_from_xml finds them, so the same style wins
+        # when names are duplicated.
+        handler.styles.sort(key=lambda found: found[:2])
+        for index, order, styleobj in handler.styles:
+            self.__styles[styleobj.name] = styleobj
+        handler.fonts.sort(key=lambda found: found[:2])
+        for index, order, fontobj in handler.fonts:
+            self.__fonts[fontobj.name] = fontobj
+
+        self.resolve()
     
     def load_from_xml(self, dom):
         for tagname in STYLE_TAGS:
@@ -287,43 +923,79 @@ class OdtStyleSet(object):
                 if font.nodeType == xml.dom.Node.ELEMENT_NODE:
                     fontobj = Font(font)
                     self.__fonts[fontobj.name] = fontobj
-        
+
+        self.resolve()
+
+    def resolve(self):
+        """Flatten the parent chain of each loaded style."""
+        resolved = {}
+        for name in self.__styles:
+            self.__resolve_style(name, resolved, [])
+        self.__resolved = resolved
+
+    def __resolve_style(self, name, resolved, chain):
+        if name in resolved:
+            return resolved[name]
+        if name in chain:
+            raise Exception("Style inheritance loop: {0}".format(
+                " -> ".join(chain + [name])))
+        style = self.__styles[name]
+        parent = None
+        if (style.parent_style_name is not None and
+                style.parent_style_name != name and
+                style.parent_style_name in self.__styles):
+            parent = self.__resolve_style(
+                style.parent_style_name, resolved, chain + [name])
+        ret = style.resolve(parent)
+        resolved[name] = ret
+        return ret
+
 
 class OdtStyle(object):
     def __init__(self, style_node):
         object.__init__(self)
         
         self.style_node = style_node
-        self.parent_style = None
         
         # Default options
         self.name = 'noop'
         self.spans = 'text'
+        self.parent_style_name = None
         self.text = {}
         self.paragraph = {}
         if style_node is not None:
-            self.name = style_node.getAttribute("style:name")
-            self.spans = style_node.getAttribute("style:family")
-            
-            self.parent_style_name = style_node.getAttribute("style:parent-style-name")
-            if self.parent_style_name is not None and (self.parent_style_name == "Standard" or len(self.parent_style_name) <= 0):
-                self.parent_style_name = None
-            
+            self.set_attributes(_get_attributes(style_node))
             for para in style_node.getElementsByTagName("style:paragraph-properties"):
-                for key, val in PARAGRAPH_STYLE_ATTRIBUTES.items():
-                    attr = para.getAttribute(key)
-                    if len(attr) > 0:
-                        self.paragraph[val] = attr
-
+                self.add_paragraph_properties(_get_attributes(para))
             for text_node in style_node.getElementsByTagName("style:text-properties"):
-                for key, val in TEXT_STYLE_ATTRIBUTES.items():
-                    if text_node.hasAttribute(key):
-                        self.text[val] = str(text_node.getAttribute(key))
-            
-            if style_node.hasAttribute("style:page-layout-name"):
-                self.spans = 'page'
-                # FIXME page layout description
-        
+                self.add_text_properties(_get_attributes(text_node))
+
+    def set_attributes(self, attrs):
+        """Set up the style from the attributes of its element."""
+        self.name = attrs.get("style:name", "")
+        self.spans = attrs.get("style:family", "")
+
+        self.parent_style_name = attrs.get("style:parent-style-name", "")
+        if self.parent_style_name == "Standard" or len(self.parent_style_name) <= 0:
+            self.parent_style_name = None
+
+        if "style:page-layout-name" in attrs:
+            self.spans = 'page'
+            # FIXME page layout description
+
+    def add_paragraph_properties(self, attrs):
+        """Add the attributes of a <style:paragraph-properties> element."""
+        for key, val in PARAGRAPH_STYLE_ATTRIBUTES.items():
+            attr = attrs.get(key, "")
+            if len(attr) > 0:
+                self.paragraph[val] = attr
+
+    def add_text_properties(self, attrs):
+        """Add the attributes of a <style:text-properties> element."""
+        for key, val in TEXT_STYLE_ATTRIBUTES.items():
+            if key in attrs:
+                self.text[val] = str(attrs[key])
+
     @property
     def is_paragraph(self):
         return self.spans == "paragraph"
@@ -334,48 +1006,90 @@ class OdtStyle(object):
     
     @property
     def font_size(self):
-        size = "11pt"
-        if 'font-size' in self.text:
-            size = self.text['font-size']
-        return size
+        return _font_size(self.text)
     
     @property
     def is_italics(self):
-        ret = False
-        if 'font-style' in self.text:
-            ret = (
-                self.text['font-style'] == 'italics' or
-                self.text['font-style'] == 'italic')
-        return ret
+        return _is_italics(self.text)
     
     @property
     def is_bold(self):
-        ret = False
-        if 'font-weight' in self.text:
-            ret = self.text['font-weight'] == 'bold'
-        return ret
+        return _is_bold(self.text)
     
     def get_font(self, styleset):
-        ret = None
-        if 'font-name' in self.text:
-            ret = styleset.get_font_by_name(self.text['font-name'])
-        return ret
-    
-    def load_parent(self, styleset):
-        if (self.parent_style is None and
-                self.parent_style_name is not None and
-                self.parent_style_name != self.name):
-            self.parent_style = styleset.get_style_by_name(self.parent_style_name)
-            if self.parent_style is not None:
-                for key, value in self.parent_style.paragraph.items():
-                    if key not in self.paragraph:
-                        self.paragraph[key] = value
-                for key, value in self.parent_style.text.items():
-                    if key not in self.text:
-                        self.text[key] = value
-        
-        # FIXME parse self.paragraph['page-style-name'] and
-        # self.paragraph['page-layout-name']
+        return _get_font(self.text, styleset)
+
+    def resolve(self, parent):
+        """Create the ResolvedStyle for this style, with the settings it
+        inherits from the (already resolved) parent style."""
+        paragraph = dict(self.paragraph)
+        text_settings = dict(self.text)
+        if parent is not None:
+            for key, value in parent.paragraph.items():
+                if key not in paragraph:
+                    paragraph[key] = value
+            for key, value in parent.text.items():
+                if key not in text_settings:
+                    text_settings[key] = value
+
+        # FIXME parse paragraph['page-style-name'] and
+        # paragraph['page-layout-name']
+
+        return ResolvedStyle(
+            self.name, self.spans, self.parent_style_name,
+            types.MappingProxyType(paragraph),
+            types.MappingProxyType(text_settings),
+            _font_size(text_settings), _is_italics(text_settings),
+            _is_bold(text_settings))
+
+
+class ResolvedStyle(collections.namedtuple('ResolvedStyle', (
+        'name', 'spans', 'parent_style_name', 'paragraph', 'text',
+        'font_size', 'is_italics', 'is_bold'))):
+    """An OdtStyle merged with all of its parent styles.  It is read-only,
+    and the common text settings are computed once."""
+    __slots__ = ()
+
+    @property
+    def is_paragraph(self):
+        return self.spans == "paragraph"
+
+    @property
+    def is_inner_text(self):
+        return self.spans == "text"
+
+    def get_font(self, styleset):
+        return _get_font(self.text, styleset)
+
+
+def _font_size(text_settings):
+    size = "11pt"
+    if 'font-size' in text_settings:
+        size = text_settings['font-size']
+    return size
+
+
+def _is_italics(text_settings):
+    ret = False
+    if 'font-style' in text_settings:
+        ret = (
+            text_settings['font-style'] == 'italics' or
+            text_settings['font-style'] == 'italic')
+    return ret
+
+
+def _is_bold(text_settings):
+    ret = False
+    if 'font-weight' in text_settings:
+        ret = text_settings['font-weight'] == 'bold'
+    return ret
+
+
+def _get_font(text_settings, styleset):
+    ret = None
+    if 'font-name' in text_settings:
+        ret = styleset.get_font_by_name(text_settings['font-name'])
+    return ret
 
 
 class Font(object):
@@ -388,44 +1102,95 @@ class Font(object):
         self.generic_family = 'unknown'
         
         if font_node is not None:
-            self.name = font_node.getAttribute("style:name")
-            self.family = font_node.getAttribute("svg:font-family")
-            self.generic_family = font_node.getAttribute("style:font-family-generic")
+            self.set_attributes(_get_attributes(font_node))
+
+    def set_attributes(self, attrs):
+        """Set up the font from the attributes of its element."""
+        self.name = attrs.get("style:name", "")
+        self.family = attrs.get("svg:font-family", "")
+        self.generic_family = attrs.get("style:font-family-generic", "")
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['font_node'] = None
+        return state
+
+
+def _get_attributes(node):
+    return dict(node.attributes.items())
 
 
-def parse_style(odt_style_list, text_style):
+class StyleHandler(object):
+    """
+    expat handler that collects the styles and fonts.  Each one is stored
+    with the index of its tag in STYLE_TAGS (or FONT_TAGS) and the order
+    it was found in, so that they can be put into the same order as
+    OdtStyleSet.load_from_xml uses.  As with the DOM version, properties
+    elements apply to all the style elements they are inside of.
+    """
+    def __init__(self):
+        object.__init__(self)
+        self.styles = []
+        self.fonts = []
+        self.__count = 0
+        # For each open element, the style it started, or None.
+        self.__elements = []
+        self.__open_styles = []
+
+    def start_element(self, name, attrs):
+        self.__count += 1
+        styleobj = None
+        if name in STYLE_TAGS:
+            styleobj = OdtStyle(None)
+            styleobj.set_attributes(attrs)
+            self.styles.append((STYLE_TAGS.index(name), self.__count, styleobj))
+            self.__open_styles.append(styleobj)
+        elif name == "style:paragraph-properties":
+            for openobj in self.__open_styles:
+                openobj.add_paragraph_properties(attrs)
+        elif name == "style:text-properties":
+            for openobj in self.__open_styles:
+                openobj.add_text_properties(attrs)
+        elif name in FONT_TAGS:
+            fontobj = Font(None)
+            fontobj.set_attributes(attrs)
+            self.fonts.append((FONT_TAGS.index(name), self.__count, fontobj))
+        self.__elements.append(styleobj)
+
+    def end_element(self, name):
+        if self.__elements.pop() is not None:
+            self.__open_styles.pop()
+
+
+def parse_style(odt_styles, text_style):
+    """Convert the StyleChain of an element into a text.Style object, based
+    on `text_style`.  Styles can't be changed, so this returns the new
+    style."""
     if isinstance(text_style, text.BlockStyle):
-        parse_block_style(odt_style_list, text_style)
+        return parse_block_style(odt_styles, text_style)
     elif isinstance(text_style, text.TextStyle):
-        parse_span_style(odt_style_list, text_style)
+        return parse_span_style(odt_styles, text_style)
     else:
         raise Exception("Not valid style: {0}".format(text_style))
-    text_style.source = odt_style_list
 
     
-def parse_block_style(odt_style_list, text_style):
+def parse_block_style(odt_styles, text_style):
     """Convert the internal style object into a text.Style object."""
-    styles = list(odt_style_list)
-    styles.reverse()
-    for style in styles:
+    for style in odt_styles:
         if style.name is not None and len(style.name) > 0:
-            text_style.name = style.name
 
             # FIXME
 
-            break
-    pass
+            return text_style.with_name(style.name)
+    return text_style
 
 
-def parse_span_style(odt_style_list, text_style):
+def parse_span_style(odt_styles, text_style):
     """Convert the internal style object into a text.Style object."""
-    styles = list(odt_style_list)
-    styles.reverse()
-    for style in styles:
+    for style in odt_styles:
         if style.name is not None and len(style.name) > 0:
-            text_style.name = style.name
-            break
-    pass
+            return text_style.with_name(style.name)
+    return text_style
 
 
 def _convert_units(self, val):
@@ -487,154 +1252,513 @@ CONTROL_TAGS = (
     )
 
 HREF_ATTR = "xlink:href"
+MIME_TYPE_ATTR = "draw:mime-type"
+BINARY_DATA_TAG = "office:binary-data"
+
+# Leading bytes -> file extension, for embedded images without a mime type.
+IMAGE_SIGNATURES = (
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8", "jpeg"),
+    (b"GIF8", "gif"),
+)
 
 
-def parse_node(node, content, parent_style_list=None):
-    if parent_style_list is None:
-        parent_style_list = []
+class StyleChain(object):
+    """
+    The styles of an element and all its parent elements, as an immutable
+    linked list.  Iterating returns the innermost style first.  Sibling
+    elements share the chain of their parent rather than copying it.
+    """
+    __slots__ = ('style', 'parent')
+
+    def __init__(self, style, parent=None):
+        self.style = style
+        self.parent = parent
+
+    def __iter__(self):
+        chain = self
+        while chain is not None:
+            yield chain.style
+            chain = chain.parent
+
+
+def parse_node(node, content, parent_styles=None, source=None):
+    """
+    Convert an element into a text node, or a list of text nodes.  Each
+    created text node's source is `source` (the text.Provenance of the
+    top-level element, if known) with its own style name.
+
+    The element tree is walked with an explicit stack rather than recursion,
+    so deeply nested elements do not run into the recursion limit.  Each tag
+    is handled by its entry in NODE_PARSERS; leaf tags return their text
+    node directly, while container tags return a NodeFrame that is pushed
+    on the stack and collects the results of its children.
+    """
+    stack = []
+    ret = _start_node(node, content, parent_styles, source)
+    if isinstance(ret, NodeFrame):
+        stack.append(ret)
+    while len(stack) > 0:
+        frame = stack[-1]
+        child = frame.next_child()
+        if child is None:
+            stack.pop()
+            ret = frame.finish()
+            if len(stack) > 0:
+                stack[-1].add(ret)
+        else:
+            val = _start_node(child, content, frame.child_styles, source)
+            if isinstance(val, NodeFrame):
+                stack.append(val)
+            else:
+                frame.add(val)
+    return ret
+
+
+def _start_node(node, content, parent_styles, source):
     tag = node.tagName
     print("Parsing {0}".format(tag))
-    style = content.get_style(node)
-    style_list = list(parent_style_list)
-    style_list.append(style)
-    if tag in CONTROL_CONTAINER_TAGS:
-        # FIXME recheck how to deal with control tags
+    styles = StyleChain(content.get_style(node), parent_styles)
+    parser = NODE_PARSERS.get(tag)
+    if parser is None:
+        raise Exception("Unknown text node: {0}".format(node.toxml()))
+    return parser(node, content, parent_styles, styles, source)
 
-        children = []
-        for child in node.childNodes:
+
+def _set_source(obj, source):
+    if source is not None:
+        obj.source = source._replace(style_name=obj.style.name)
+
+
+class NodeFrame(object):
+    """A container element in the middle of being parsed."""
+    def __init__(self, node, child_styles, source):
+        object.__init__(self)
+        self.node = node
+        self.child_styles = child_styles
+        self.source = source
+        self._children = iter(node.childNodes)
+
+    def next_child(self):
+        """The next child element to parse, or None when all are done."""
+        raise NotImplementedError()
+
+    def add(self, val):
+        """Add the parsed value of the last child returned by next_child."""
+        raise NotImplementedError()
+
+    def finish(self):
+        """Return the parsed value of the element."""
+        raise NotImplementedError()
+
+
+class ControlContainerFrame(NodeFrame):
+    # FIXME recheck how to deal with control tags
+    def __init__(self, node, content, parent_styles, styles, source):
+        NodeFrame.__init__(self, node, styles, source)
+        self.children = []
+
+    def next_child(self):
+        for child in self._children:
             ntype = child.nodeType
             if ntype == xml.dom.Node.ELEMENT_NODE:
-                children.append(parse_node(child, content, style_list))
+                return child
             elif (ntype == xml.dom.Node.TEXT_NODE or
                     ntype == xml.dom.Node.CDATA_SECTION_NODE):
-                raise Exception("Text element in control {0}".format(node.toxml()))
-            else:
-                # Ignore non elements and text nodes
-                pass
-        if len(children) == 1:
-            return children[0]
+                raise Exception("Text element in control {0}".format(self.node.toxml()))
+            # Ignore non elements and text nodes
+        return None
+
+    def add(self, val):
+        self.children.append(val)
+
+    def finish(self):
+        if len(self.children) == 1:
+            return self.children[0]
         # elif len(children) <= 0:
         #    return TextWhitespace(style, node)
         # else:
         #    return TextContainer(children[0].style, children, node)
-        else:
-            raise Exception("Unknown parsing for control tag {0}".format(node.toxml()))
-    
-    elif tag in PARA_TAGS:
-        ret_list = []
-        ret = text.Para()
-        parse_style(style_list, ret.style)
-        for child in node.childNodes:
-            ntype = child.nodeType
-            if (ntype == xml.dom.Node.ELEMENT_NODE and
-                    child.tagName in DATA_TAGS):
-                child = child.childNodes[0]
-                ntype = child.nodeType
-            
-            if ntype == xml.dom.Node.ELEMENT_NODE:
-                pchild = parse_node(child, content, style_list)
-                if not isinstance(pchild, list):
-                    pchild = [pchild]
-                if isinstance(pchild, list):
-                    for ch in pchild:
-                        if isinstance(ch, text.Div):
-                            # A new top-level div inside this one.  Break it apart
-                            # so that the returned paragraphs only have spans.
-                            prev_style = ret.style
-                            ret_list.append(ret)
-                            ret_list.append(ch)
-                            ret = text.Para()
-                            ret.style = prev_style
-                        else:
-                            ret.add_span(ch)
-            elif (ntype == xml.dom.Node.TEXT_NODE or
-                    ntype == xml.dom.Node.CDATA_SECTION_NODE):
-                pchild = text.Text()
-                pchild.text = child.data
-                pchild.source = node
-                parse_style(style_list, pchild.style)
-                ret.add_span(pchild)
-            else:
-                # Ignore non elements and text nodes
-                pass
-        ret_list.append(ret)
-        return ret_list
+        raise Exception("Unknown parsing for control tag {0}".format(self.node.toxml()))
 
-    elif tag in SPAN_TAGS:
-        ret = []
-        for child in node.childNodes:
+
+class InlineFrame(NodeFrame):
+    """Common handling for the children of paragraphs and spans."""
+    def next_child(self):
+        for child in self._children:
             ntype = child.nodeType
             if (ntype == xml.dom.Node.ELEMENT_NODE and
                     child.tagName in DATA_TAGS):
                 child = child.childNodes[0]
                 ntype = child.nodeType
-            
+
             if ntype == xml.dom.Node.ELEMENT_NODE:
-                pchild = parse_node(child, content, style_list)
-                if isinstance(pchild, list):
-                    ret.extend(pchild)
-                else:
-                    ret.append(pchild)
+                return child
             elif (ntype == xml.dom.Node.TEXT_NODE or
                     ntype == xml.dom.Node.CDATA_SECTION_NODE):
                 pchild = text.Text()
                 pchild.text = child.data
-                pchild.source = node
-                parse_style(style_list, pchild.style)
-                ret.append(pchild)
+                pchild.style = parse_style(self.child_styles, pchild.style)
+                _set_source(pchild, self.source)
+                self.add_span(pchild)
+            # Ignore non elements and text nodes
+        return None
+
+    def add_span(self, span):
+        raise NotImplementedError()
+
+
+class ParaFrame(InlineFrame):
+    def __init__(self, node, content, parent_styles, styles, source):
+        InlineFrame.__init__(self, node, styles, source)
+        self.ret_list = []
+        self.ret = text.Para()
+        self.ret.style = parse_style(styles, self.ret.style)
+        _set_source(self.ret, source)
+
+    def add_span(self, span):
+        self.ret.add_span(span)
+
+    def add(self, val):
+        if not isinstance(val, list):
+            val = [val]
+        for ch in val:
+            if isinstance(ch, text.Div):
+                # A new top-level div inside this one.  Break it apart
+                # so that the returned paragraphs only have spans.
+                prev_style = self.ret.style
+                self.ret_list.append(self.ret)
+                self.ret_list.append(ch)
+                self.ret = text.Para()
+                self.ret.style = prev_style
+                _set_source(self.ret, self.source)
             else:
-                # Ignore non elements and text nodes
-                pass
-        return ret
+                self.ret.add_span(ch)
 
-    elif tag in TAB_TAGS:
-        ret = text.Text()
-        parse_style(style_list, ret.style)
-        ret.text = "\t"
-        return ret
+    def finish(self):
+        self.ret_list.append(self.ret)
+        return self.ret_list
 
-    elif tag in WHITESPACE_SPAN_TAGS:
-        ret = text.Text()
-        parse_style(style_list, ret.style)
-        return ret
 
-    elif tag in WHITESPACE_DIV_TAGS or tag in CONTROL_TAGS:
-        # This indicates a new paragraph.  However, it's a stand-alone tag.
-        ret = text.Para()
-        parse_style(style_list, ret.style)
-        return ret
+class SpanFrame(InlineFrame):
+    def __init__(self, node, content, parent_styles, styles, source):
+        InlineFrame.__init__(self, node, styles, source)
+        self.ret = []
 
-    elif tag in DATA_TAGS:
-        print("Unexpected data tag at top level: {0}".format(node.toxml()))
+    def add_span(self, span):
+        self.ret.append(span)
 
-    elif tag in MEDIA_CONTAINER_TAGS:
-        ret = text.SideBar()
-        kid_list = list(parent_style_list)
-        kid_list.append(ret.style)
-        parse_block_style(kid_list, ret.style)
-        for child in node.childNodes:
-            pchild = parse_node(child, content, kid_list)
-            if isinstance(pchild, list):
-                ret.divs.extend(pchild)
-            else:
-                ret.divs.append(pchild)
-        return ret
-
-    elif tag in IMAGE_TAGS:
-        if node.hasAttribute(HREF_ATTR):
-            ret = OdtImage(node.getAttribute(HREF_ATTR), content.lowodf)
-            kid_list = list(parent_style_list)
-            kid_list.append(ret.style)
-            parse_block_style(kid_list, ret.style)
-            return ret
+    def add(self, val):
+        if isinstance(val, list):
+            self.ret.extend(val)
         else:
-            raise Exception("No href tag in image {0}".format(node.toxml()))
+            self.ret.append(val)
+
+    def finish(self):
+        return self.ret
+
+
+class MediaContainerFrame(NodeFrame):
+    def __init__(self, node, content, parent_styles, styles, source):
+        self.ret = text.SideBar()
+        self.ret.style = parse_block_style(
+            StyleChain(self.ret.style, parent_styles), self.ret.style)
+        kid_styles = StyleChain(self.ret.style, parent_styles)
+        _set_source(self.ret, source)
+        NodeFrame.__init__(self, node, kid_styles, source)
+        self.divs = []
+
+    def next_child(self):
+        return next(self._children, None)
+
+    def add(self, val):
+        if isinstance(val, list):
+            self.divs.extend(val)
+        elif val is not None:
+            self.divs.append(val)
 
+    def finish(self):
+        self.ret.divs = self.divs
+        return self.ret
+
+
+def _parse_tab(node, content, parent_styles, styles, source):
+    ret = text.Text()
+    ret.style = parse_style(styles, ret.style)
+    _set_source(ret, source)
+    ret.text = "\t"
+    return ret
+
+
+def _parse_whitespace_span(node, content, parent_styles, styles, source):
+    ret = text.Text()
+    ret.style = parse_style(styles, ret.style)
+    _set_source(ret, source)
+    return ret
+
+
+def _parse_whitespace_div(node, content, parent_styles, styles, source):
+    # This indicates a new paragraph.  However, it's a stand-alone tag.
+    ret = text.Para()
+    ret.style = parse_style(styles, ret.style)
+    _set_source(ret, source)
+    return ret
+
+
+def _parse_data(node, content, parent_styles, styles, source):
+    print("Unexpected data tag at top level: {0}".format(node.toxml()))
+    return None
+
+
+def _parse_image(node, content, parent_styles, styles, source):
+    if node.hasAttribute(HREF_ATTR):
+        if content.lowodf is None:
+            raise Exception("Linked images are only supported in packaged documents: {0}".format(
+                node.toxml()))
+        ret = OdtImage(node.getAttribute(HREF_ATTR), content.lowodf)
     else:
-        raise Exception("Unknown text node: {0}".format(node.toxml()))
+        # Embedded in the XML, as flat files do.
+        ret = _parse_embedded_image(node)
+        if ret is None:
+            print("*** Skipping image with no href or data: {0}".format(node.toxml()))
+            return None
+    ret.style = parse_block_style(StyleChain(ret.style, parent_styles), ret.style)
+    _set_source(ret, source)
+    return ret
+
+
+def _parse_embedded_image(node):
+    """The EmbeddedImage for the <office:binary-data> of the image element,
+    or None if it has none, or it is not a known type."""
+    data = None
+    for child in node.childNodes:
+        if child.nodeType == xml.dom.Node.ELEMENT_NODE and child.tagName == BINARY_DATA_TAG:
+            data = base64.b64decode("".join(
+                kid.data for kid in child.childNodes
+                if kid.nodeType == xml.dom.Node.TEXT_NODE))
+    if data is None:
+        return None
+    ext = node.getAttribute(MIME_TYPE_ATTR).split('/')[-1]
+    if len(ext) <= 0:
+        for signature, val in IMAGE_SIGNATURES:
+            if data.startswith(signature):
+                ext = val
+                break
+        else:
+            return None
+    return EmbeddedImage(data, ext)
+
+
+# tag name -> callable(node, content, parent_styles, styles, source) that
+# returns the parsed value, or a NodeFrame for container tags.
+NODE_PARSERS = {}
+for _tags, _parser in (
+        (CONTROL_CONTAINER_TAGS, ControlContainerFrame),
+        (PARA_TAGS, ParaFrame),
+        (SPAN_TAGS, SpanFrame),
+        (TAB_TAGS, _parse_tab),
+        (WHITESPACE_SPAN_TAGS, _parse_whitespace_span),
+        (WHITESPACE_DIV_TAGS, _parse_whitespace_div),
+        (CONTROL_TAGS, _parse_whitespace_div),
+        (DATA_TAGS, _parse_data),
+        (MEDIA_CONTAINER_TAGS, MediaContainerFrame),
+        (IMAGE_TAGS, _parse_image)):
+    for _tag in _tags:
+        NODE_PARSERS[_tag] = _parser
+
+
+def coalesce_spans(div):
+    """Join the adjacent plain text spans in the paragraphs of the div that
+    have the same style."""
+    if isinstance(div, LazyPara) and not div.is_parsed():
+        # Done when the spans are parsed.
+        div.coalesce = True
+    elif isinstance(div, text.Para):
+        spans = []
+        for span in div.spans:
+            if (len(spans) > 0 and type(span) is text.Text and
+                    type(spans[-1]) is text.Text and
+                    _is_same_style(spans[-1].style, span.style)):
+                spans[-1].text += span.text
+            else:
+                spans.append(span)
+        div.spans = spans
+    elif isinstance(div, text.SideBar):
+        for child in div.divs:
+            coalesce_spans(child)
+
+
+def _is_same_style(style1, style2):
+    return style1 is style2 or style1 == style2
+
+
+# The only elements in a paragraph that LazyPara handles.
+LAZY_PARA_TAGS = frozenset(tag.encode() for tag in (
+    PARA_TAGS + SPAN_TAGS + WHITESPACE_SPAN_TAGS + TAB_TAGS))
+# Start tags, comments, processing instructions and CDATA sections.
+RAW_START_TAG_RE = re.compile(br"<([^\s/>]+)")
+RAW_ATTRIBUTE_RE = re.compile(br"""\s([^\s=>]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+def is_lazy_para(raw):
+    """Whether the raw XML is a plain paragraph, with only text, spans,
+    tabs and spaces; these are parsed into a single Para with only
+    Text spans."""
+    tags = RAW_START_TAG_RE.findall(raw)
+    if len(tags) <= 0 or tags[0] not in (b"text:p", b"text:h"):
+        return False
+    for tag in tags:
+        if tag not in LAZY_PARA_TAGS:
+            return False
+    return True
+
+
+def get_raw_attributes(raw):
+    """The attributes of the first start tag in the raw XML."""
+    end = raw.index(b">")
+    ret = {}
+    for name, val1, val2 in RAW_ATTRIBUTE_RE.findall(raw, 0, end):
+        val = val1 or val2
+        if b"&" in val:
+            val = parse_fragment(b"<a v='" + val + b"'/>").getAttribute("v").encode()
+        ret[name.decode()] = val.decode()
+    return ret
+
+
+def get_raw_text(raw):
+    """The text of the raw paragraph XML, as Para.get_text() would return
+    it, without building the spans."""
+    ret = []
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.CharacterDataHandler = ret.append
+
+    def start_element(name, attrs):
+        if name in TAB_TAGS:
+            ret.append("\t")
+    parser.StartElementHandler = start_element
+    parser.Parse(raw, True)
+    return "".join(ret)
+
+
+class LazyPara(text.Para):
+    """
+    A paragraph read from the raw XML of a plain paragraph (see
+    is_lazy_para()).  The style is set up front, but the spans are only
+    parsed when `spans` or get_children() is first used; after that, the
+    XML is dropped.  get_text() reads the text straight from the XML.
+    """
+    __slots__ = ('__raw', '__content', '__spans', '__text', 'coalesce')
+
+    def __init__(self, raw, content, source):
+        text.Para.__init__(self)
+        self.__raw = raw
+        self.__content = content
+        self.__spans = None
+        self.__text = None
+        # Join the spans when they are parsed.
+        self.coalesce = False
+
+        attrs = get_raw_attributes(raw)
+        style = None
+        for attr in STYLE_ATTRIBUTES:
+            style = content.get_style_by_name(attrs.get(attr, ""))
+            if style is not None:
+                break
+        self.style = parse_style(StyleChain(style, None), self.style)
+        _set_source(self, source)
+
+    def is_parsed(self):
+        return self.__spans is not None
+
+    @property
+    def spans(self):
+        if self.__spans is None:
+            self.__parse()
+        return self.__spans
+
+    @spans.setter
+    def spans(self, spans):
+        self.__spans = spans
+        self.__raw = None
+        self.__content = None
+        self.__text = None
+        self.invalidate_text()
+
+    def get_text(self):
+        if self.__spans is None:
+            if self.__text is None:
+                self.__text = get_raw_text(self.__raw)
+            return self.__text
+        return text.Para.get_text(self)
+
+    def __parse(self):
+        vals = self.__content.convert_node(parse_fragment(self.__raw), self.source)
+        assert len(vals) == 1 and isinstance(vals[0], text.Para), \
+            "Not a plain paragraph: {0!r}".format(self.__raw)
+        if self.coalesce:
+            coalesce_spans(vals[0])
+        self.spans = vals[0].spans
+
+    def __getstate__(self):
+        # Pickle the parsed spans rather than the content file.
+        self.spans
+        return text.Para.__getstate__(self)
+
+
+_worker_content = None
+
+
+def _init_parse_worker(filename, styles):
+    global _worker_content
+    _worker_content = ContentFile(LowODF(zipfile.ZipFile(filename, 'r')), styles)
+
+
+def _parse_chunk(chunk, content=None):
+    """Parse the raw top-level elements in a worker process."""
+    if content is None:
+        content = _worker_content
+    ret = []
+    for ordinal, line, offset, raw in chunk:
+        source = text.Provenance(ordinal, line, offset, None)
+        ret.extend(content.convert_node(parse_fragment(raw), source))
+    return dumps_text(ret)
+
+
+class TextPickler(pickle.Pickler):
+    """Pickles text nodes.  References to the package (from images) are
+    stored by reference, and are replaced by the package given to the
+    TextUnpickler."""
+    def persistent_id(self, obj):
+        if isinstance(obj, LowODF):
+            return "lowodf"
+        return None
+
+
+class TextUnpickler(pickle.Unpickler):
+    def __init__(self, stream, lowodf):
+        pickle.Unpickler.__init__(self, stream)
+        self.lowodf = lowodf
+
+    def persistent_load(self, pid):
+        if pid == "lowodf":
+            return self.lowodf
+        raise pickle.UnpicklingError("unknown reference {0}".format(pid))
+
+
+def dumps_text(obj):
+    out = io.BytesIO()
+    TextPickler(out, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return out.getvalue()
+
+
+def loads_text(data, lowodf):
+    return TextUnpickler(io.BytesIO(data), lowodf).load()
 
 
 class OdtImage(text.Image):
+    __slots__ = ('__low',)
+
     def __init__(self, rel_name, low):
         assert isinstance(low, LowODF)
         assert low.has_file(rel_name), "ODT has no file {0}".format(rel_name)
@@ -642,8 +1766,18 @@ class OdtImage(text.Image):
         self.__low = low
 
     def save_as(self, dest_file_stream):
-        inp = self.__low.read_file(self.filename)
-        try:
-            dest_file_stream.write(inp.read())
-        finally:
-            inp.close()
+        self.__low.copy_file(self.filename, dest_file_stream)
+
+
+class EmbeddedImage(text.Image):
+    """An image whose data was embedded in the document's XML.  It is named
+    after a hash of the data."""
+    __slots__ = ('data',)
+
+    def __init__(self, data, ext):
+        text.Image.__init__(self, "Pictures/{0}.{1}".format(
+            hashlib.sha256(data).hexdigest()[:32], ext))
+        self.data = data
+
+    def save_as(self, dest_file_stream):
+        dest_file_stream.write(self.data)
@@ -0,0 +1,263 @@
+"""
+Streams over the members of a zip package (such as an ODT file), used
+by odt.LowODF.
+"""
+
+import collections
+import mmap
+import struct
+import threading
+import zipfile
+import zlib
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Number of chunks that a prefetch thread decompresses ahead of the reader.
+PREFETCH_CHUNKS = 16
+
+# Seconds that a prefetch thread waits on a full buffer before it leaves
+# the rest of the file to the reader.
+PREFETCH_IDLE_TIMEOUT = 2.0
+
+
+# Zip local file header: signature, version, flags, compression, time, date,
+# crc, compressed size, size, name length, extra length.
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_LOCAL_SIGNATURE = b"PK\003\004"
+ZIP_ENCRYPTED_FLAG = 0x1
+
+
+class MappedZip(object):
+    """
+    Memory mapped access to the files of a zip package.  Stored
+    (uncompressed) files, which is how images are usually kept, are
+    available as memoryview slices of the mapping, so that they can be
+    written out without copying them onto the Python heap.  Deflated files
+    are inflated from the mapping a chunk at a time.
+
+    Files that are encrypted or use another compression are not handled
+    here (the methods return None); use the zipfile for those.
+    """
+    def __init__(self, filename, infos):
+        object.__init__(self)
+        self.filename = filename
+        self.__infos = infos
+        self.__offsets = {}
+        with open(filename, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+
+    def get_file_view(self, name):
+        info = self.__infos[name]
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        return self.__get_data(info)
+
+    def open_file(self, name):
+        info = self.__infos[name]
+        if info.compress_type == zipfile.ZIP_STORED:
+            data = self.__get_data(info)
+            if data is None:
+                return None
+            return ViewStream(data)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = self.__get_data(info)
+            if data is None:
+                return None
+            return InflateStream(data, info.CRC, info.filename)
+        return None
+
+    def __get_data(self, info):
+        """The view of the file's (compressed) bytes."""
+        if info.flag_bits & ZIP_ENCRYPTED_FLAG:
+            return None
+        start = self.__offsets.get(info.filename)
+        if start is None:
+            header = ZIP_LOCAL_HEADER.unpack_from(self.__map, info.header_offset)
+            if header[0] != ZIP_LOCAL_SIGNATURE:
+                raise Exception("Bad zip file header for {0}".format(info.filename))
+            start = (info.header_offset + ZIP_LOCAL_HEADER.size +
+                     header[9] + header[10])
+            self.__offsets[info.filename] = start
+        return self.__view[start:start + info.compress_size]
+
+    def close(self):
+        """Unmap the file.  If views of it are still in use, it is unmapped
+        once they are freed."""
+        if self.__map is None:
+            return
+        self.__view.release()
+        try:
+            self.__map.close()
+        except BufferError:
+            pass
+        self.__map = None
+        self.__view = None
+
+
+class ViewStream(object):
+    """Read-only stream over a memoryview, which copies out only the bytes
+    that are read."""
+    def __init__(self, data):
+        object.__init__(self)
+        self.__data = data
+        self.__pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.__data) - self.__pos
+        ret = bytes(self.__data[self.__pos:self.__pos + size])
+        self.__pos += len(ret)
+        return ret
+
+    def close(self):
+        self.__data = None
+
+
+class InflateStream(object):
+    """
+    Read-only stream that inflates raw deflate data (a view of the memory
+    mapped package) on demand, so that no more than a chunk is held.
+    """
+    def __init__(self, data, crc, name, chunk_size=STREAM_CHUNK_SIZE):
+        object.__init__(self)
+        self.name = name
+        self.chunk_size = chunk_size
+        self.__data = data
+        self.__pos = 0
+        self.__crc = crc
+        self.__running_crc = 0
+        self.__inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.__tail = b""
+
+    def read(self, size=-1):
+        """Read up to `size` bytes (all the bytes, if negative)."""
+        if size is None or size < 0:
+            ret = []
+            while True:
+                data = self.read(self.chunk_size)
+                if len(data) <= 0:
+                    return b"".join(ret)
+                ret.append(data)
+        ret = b""
+        while len(ret) <= 0:
+            if len(self.__tail) <= 0:
+                if self.__pos >= len(self.__data):
+                    if not self.__inflater.eof:
+                        ret = self.__inflater.flush()
+                        self.__running_crc = zlib.crc32(ret, self.__running_crc)
+                    if len(ret) <= 0:
+                        self.__check_crc()
+                    return ret
+                self.__tail = self.__data[self.__pos:self.__pos + self.chunk_size]
+                self.__pos += len(self.__tail)
+            ret = self.__inflater.decompress(self.__tail, size)
+            self.__tail = self.__inflater.unconsumed_tail
+        self.__running_crc = zlib.crc32(ret, self.__running_crc)
+        return ret
+
+    def __check_crc(self):
+        if self.__crc is not None and self.__running_crc != self.__crc:
+            raise Exception("Bad CRC for {0}".format(self.name))
+        self.__crc = None
+
+    def close(self):
+        self.__data = None
+        self.__tail = b""
+
+
+class PrefetchStream(object):
+    """
+    Read-only stream over another stream (an open zip file member), which
+    is read ahead by fill(), running in another thread.  At most
+    `max_chunks` chunks are held.  If the reader does not take any chunks
+    for `idle_timeout` seconds, fill() stops, and the reader reads the rest
+    of the source stream itself.
+    """
+    def __init__(self, source, chunk_size=STREAM_CHUNK_SIZE,
+                 max_chunks=PREFETCH_CHUNKS, idle_timeout=PREFETCH_IDLE_TIMEOUT):
+        object.__init__(self)
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.idle_timeout = idle_timeout
+        self.__source = source
+        self.__lock = threading.Condition()
+        self.__chunks = collections.deque()
+        self.__partial = b""
+        # fill() has not finished yet; only it may read the source.
+        self.__filling = True
+        self.__eof = False
+        self.__closed = False
+        self.__error = None
+
+    def fill(self):
+        """Read the source stream into the buffer."""
+        try:
+            while True:
+                with self.__lock:
+                    while len(self.__chunks) >= self.max_chunks and not self.__closed:
+                        if not self.__lock.wait(self.idle_timeout):
+                            break
+                    if self.__closed or len(self.__chunks) >= self.max_chunks:
+                        return
+                data = self.__source.read(self.chunk_size)
+                with self.__lock:
+                    if len(data) <= 0:
+                        self.__eof = True
+                        return
+                    self.__chunks.append(data)
+                    self.__lock.notify_all()
+        except BaseException as e:
+            with self.__lock:
+                self.__error = e
+        finally:
+            with self.__lock:
+                self.__filling = False
+                if self.__closed:
+                    self.__source.close()
+                self.__lock.notify_all()
+
+    def read(self, size=-1):
+        """Read up to `size` bytes (all the bytes, if negative)."""
+        if size is None or size < 0:
+            ret = []
+            while True:
+                data = self.__next_chunk()
+                if len(data) <= 0:
+                    return b"".join(ret)
+                ret.append(data)
+        data = self.__next_chunk()
+        if len(data) > size:
+            self.__partial = data[size:]
+            data = data[:size]
+        return data
+
+    def __next_chunk(self):
+        if len(self.__partial) > 0:
+            ret = self.__partial
+            self.__partial = b""
+            return ret
+        with self.__lock:
+            while len(self.__chunks) <= 0 and self.__filling:
+                self.__lock.wait()
+            if len(self.__chunks) > 0:
+                ret = self.__chunks.popleft()
+                self.__lock.notify_all()
+                return ret
+            if self.__error is not None:
+                raise self.__error
+            if self.__eof or self.__closed:
+                return b""
+        # fill() gave up; read the rest directly.
+        return self.__source.read(self.chunk_size)
+
+    def close(self):
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__chunks.clear()
+            self.__lock.notify_all()
+            if not self.__filling:
+                self.__source.close()
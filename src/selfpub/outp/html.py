@@ -4,8 +4,8 @@ Simple HTML output.  Useful for checking the conversion.
 
 
 from .output import OutputFile
+from .media import MediaWriter
 from .. import text
-import os
 
 
 class HtmlOutput(OutputFile):
@@ -33,19 +33,24 @@ class HtmlOutput(OutputFile):
         self.__metadata = metadata
 
     def write(self):
+        media = None
+        if self.__outdir is not None:
+            media = MediaWriter(self.__outdir)
         with open(self.__outfile, "w") as out:
             if self.__metadata is not None:
                 write_metadata(self.__metadata, out)
             else:
                 write_generic_header(out)
             for sec in self.__title_stuff:
-                write_part(sec, out)
+                write_part(sec, out, media)
             write_toc(self.__chapter_titles, out)
 
             for sec in self.__chapters:
-                write_chapter(sec, out, self.__outdir)
+                write_chapter(sec, out, media)
 
             write_footer(out)
+        if media is not None:
+            print(media.report())
 
     def preview(self):
         pass
@@ -92,29 +97,27 @@ def write_toc(titles, out):
     out.write("    </ol>\n")
 
 
-def write_chapter(sec, out, outdir):
+def write_chapter(sec, out, media):
     assert isinstance(sec, text.Chapter)
     out.write("    <h4><a name='{0}'>{0}</a></h4>\n".format(sec.name))
     for part in sec.get_children():
-        write_part(part, out, outdir)
+        write_part(part, out, media)
 
 
-def write_part(sec, out, outdir, pref=">"):
+def write_part(sec, out, media, pref=">"):
+    """Write the part.  `media` is the MediaWriter for the images, or None
+    to not write them."""
     if isinstance(sec, text.Image):
         print(pref+" image")
-        if outdir is not None:
-            fname = os.path.join(outdir, sec.filename)
-            dirname = os.path.split(fname)[0]
-            if not os.path.isdir(dirname):
-                os.makedirs(dirname)
-            with open(fname, "wb") as f:
-                sec.save_as(f)
-        out.write("    <img src='{0}'>\n".format(sec.filename))
+        filename = sec.filename
+        if media is not None:
+            filename = media.write(sec)
+        out.write("    <img src='{0}'>\n".format(filename))
     elif isinstance(sec, text.Para):
         print(pref+" para")
         out.write("    <p>")
         for span in sec.get_children():
-            write_part(span, out, outdir, pref+">")
+            write_part(span, out, media, pref+">")
         out.write("</p>\n")
     elif isinstance(sec, text.Text):
         # italics and so on
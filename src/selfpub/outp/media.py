@@ -0,0 +1,98 @@
+"""
+Writes the media files (images) used in a book.
+"""
+
+import hashlib
+import os
+
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class MediaWriter(object):
+    """
+    Writes media files into an output directory.  The media are streamed in
+    chunks rather than read into memory.  Files are identified by a hash of
+    their content: a picture used several times in the book is only written
+    once, and a file that already exists in the directory with the same
+    content is not written again.  A picture with the same name as a
+    different one that was already written gets a new name.
+    """
+    def __init__(self, outdir):
+        object.__init__(self)
+        self.outdir = outdir
+        self.bytes_written = 0
+        self.bytes_saved = 0
+        # digest -> name written under
+        self.__written = {}
+        # names written under
+        self.__names = set()
+
+    def write(self, media):
+        """Write the media object, and return the file name, relative to
+        the output directory, that has its contents."""
+        digest, size = get_media_digest(media)
+        if digest in self.__written:
+            self.bytes_saved += size
+            return self.__written[digest]
+
+        name = self.__get_name(media.filename)
+        fname = os.path.join(self.outdir, name)
+        if os.path.isfile(fname) and get_file_digest(fname) == digest:
+            self.bytes_saved += size
+        else:
+            dirname = os.path.split(fname)[0]
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(fname, "wb") as f:
+                media.save_as(f)
+            self.bytes_written += size
+        self.__written[digest] = name
+        self.__names.add(name)
+        return name
+
+    def __get_name(self, name):
+        """The name, or if another file was written under it, the name with
+        a number added."""
+        base, ext = os.path.splitext(name)
+        ret = name
+        count = 1
+        while ret in self.__names:
+            count += 1
+            ret = "{0}-{1}{2}".format(base, count, ext)
+        return ret
+
+    def report(self):
+        return "media: {0} bytes written, {1} bytes saved".format(
+            self.bytes_written, self.bytes_saved)
+
+
+class DigestStream(object):
+    """Write-only stream that only records the hash and size of the data."""
+    def __init__(self):
+        object.__init__(self)
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+
+def get_media_digest(media):
+    """Return the content hash and size of the media object."""
+    out = DigestStream()
+    media.save_as(out)
+    return out.hash.hexdigest(), out.size
+
+
+def get_file_digest(filename):
+    out = DigestStream()
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(COPY_CHUNK_SIZE)
+            if len(data) <= 0:
+                break
+            out.write(data)
+    return out.hash.hexdigest()
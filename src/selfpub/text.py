@@ -2,6 +2,8 @@
 Generic interchange document structures.
 """
 
+import collections
+
 
 STYLE_TYPE_INT = 'int'
 STYLE_TYPE_FLOAT = 'float'
@@ -16,101 +18,234 @@ STYLE_TYPES = (
 
 
 class Style(object):
-    def __init__(self, types):
+    """
+    An immutable set of style settings, with the style's name.  Styles are
+    hashable, and compare equal when they have the same class, name and
+    settings.  Get them through get_style() (or a StyleRegistry), so that
+    all the nodes with the same style share one object; to change a style,
+    use with_name() or with_setting(), which return another shared style.
+
+    Subclasses define TYPES, the setting name -> STYLE_TYPE_* or list of
+    allowed values.
+    """
+    __slots__ = ('__name', '__settings', '__key')
+    TYPES = {}
+
+    def __init__(self, name=None, settings=None):
         object.__init__(self)
-        self.name = None
-        self.source = None
-        self.__settings = {}
-        self.__types = types
-        for key, val in types.items():
-            assert (isinstance(key, str)
-                ), "key '{0}' not string".format(key)
-            if isinstance(val, str):
-                assert (val in STYLE_TYPES
-                    ), "key '{0}' type '{1}' not valid".format(key, val)
-            else:
-                assert (hasattr(val, '__iter__') and callable(getattr(val, '__iter__'))
-                    ), "key '{0}' type '{1}' not list".format(key, val)
-                # FIXME Assert entries in type are strings
+        items = _convert_settings(self.TYPES, settings)
+        self.__name = name
+        self.__settings = dict(items)
+        self.__key = (type(self), name, items)
+
+    @property
+    def name(self):
+        return self.__name
 
     def get_setting(self, name):
         if name in self.__settings:
             return self.__settings[name]
-        if name in self.__types:
+        if name in self.TYPES:
             return None
         raise Exception("bad setting name: {0}".format(str(name)))
 
+    def get_settings(self):
+        """The settings that are set, as a new dict."""
+        return dict(self.__settings)
+
     def set_setting(self, name, value):
-        if name in self.__types:
-            t = self.__types[name]
-            if t == STYLE_TYPE_INT:
-                value = int(value)
-            elif t == STYLE_TYPE_FLOAT:
-                value = float(value)
-            elif t == STYLE_TYPE_CDATA:
-                value = str(value)
-            elif t == STYLE_TYPE_BOOLEAN:
-                value = bool(value)
-            else:
-                value = str(value).lower()
-                if value not in t:
-                    raise Exception("Bad setting value for name {0}: {1}".format(
-                        str(name), value))
-            self.__settings[name] = value
-        raise Exception("bad setting name: {0}".format(str(name)))
+        raise Exception("styles can't be changed; use with_setting({0!r}, ...)".format(name))
+
+    def with_name(self, name):
+        """The style with this name and the same settings."""
+        if name == self.__name:
+            return self
+        return get_style(type(self), name, self.__settings)
 
-    def defaults(self, default_settings):
-        for key, val in default_settings.iteritems():
-            self.set_setting(key, val)
+    def with_setting(self, name, value):
+        """The style with the setting changed."""
+        return self.with_settings({name: value})
+
+    def with_settings(self, settings):
+        """The style with the given settings changed."""
+        new_settings = dict(self.__settings)
+        new_settings.update(settings)
+        return get_style(type(self), self.__name, new_settings)
 
     def keys(self):
-        return self.__types.keys()
+        return self.TYPES.keys()
 
     def __getitem__(self, key):
         return self.get_setting(key)
-    
-    def __setitem__(self, name, value):
-        self.set_setting(name, value)
-    
+
+    def __eq__(self, other):
+        return isinstance(other, Style) and self.__key == other.__key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.__key)
+
+    def __reduce__(self):
+        # Unpickled styles are shared like any other.
+        return get_style, self.__key
+
     def __str__(self):
-        return "Style({0}: {1})".format(self.name, self.__settings)
+        return "Style({0}: {1})".format(self.__name, self.__settings)
+
+
+def _check_types(types):
+    for key, val in types.items():
+        assert (isinstance(key, str)
+            ), "key '{0}' not string".format(key)
+        if isinstance(val, str):
+            assert (val in STYLE_TYPES
+                ), "key '{0}' type '{1}' not valid".format(key, val)
+        else:
+            assert (hasattr(val, '__iter__') and callable(getattr(val, '__iter__'))
+                ), "key '{0}' type '{1}' not list".format(key, val)
+            # FIXME Assert entries in type are strings
+
+
+def _convert_settings(types, settings):
+    """The settings as a sorted tuple of (name, value), with the values
+    converted to their types."""
+    if not settings:
+        return ()
+    if isinstance(settings, dict):
+        settings = settings.items()
+    ret = []
+    for name, value in settings:
+        if name not in types:
+            raise Exception("bad setting name: {0}".format(str(name)))
+        t = types[name]
+        if value is None:
+            continue
+        elif t == STYLE_TYPE_INT:
+            value = int(value)
+        elif t == STYLE_TYPE_FLOAT:
+            value = float(value)
+        elif t == STYLE_TYPE_CDATA:
+            value = str(value)
+        elif t == STYLE_TYPE_BOOLEAN:
+            value = bool(value)
+        else:
+            value = str(value).lower()
+            if value not in t:
+                raise Exception("Bad setting value for name {0}: {1}".format(
+                    str(name), value))
+        ret.append((name, value))
+    ret.sort()
+    return tuple(ret)
 
 
 class BlockStyle(Style):
-    def __init__(self):
-        # All size measurements in mm
-        Style.__init__(self, {
-            'margin-left': STYLE_TYPE_FLOAT,
-            'margin-right': STYLE_TYPE_FLOAT,
-            'margin-top': STYLE_TYPE_FLOAT,
-            'margin-bottom': STYLE_TYPE_FLOAT,
-            'page-break': STYLE_TYPE_BOOLEAN,
-            'h-align': ["center", "left", "right", "justify"],
-            'border-left-width': STYLE_TYPE_INT,
-            'border-right-width': STYLE_TYPE_INT,
-            'border-top-width': STYLE_TYPE_INT,
-            'border-bottom-width': STYLE_TYPE_INT
-        })
+    __slots__ = ()
+    # All size measurements in mm
+    TYPES = {
+        'margin-left': STYLE_TYPE_FLOAT,
+        'margin-right': STYLE_TYPE_FLOAT,
+        'margin-top': STYLE_TYPE_FLOAT,
+        'margin-bottom': STYLE_TYPE_FLOAT,
+        'page-break': STYLE_TYPE_BOOLEAN,
+        'h-align': ["center", "left", "right", "justify"],
+        'border-left-width': STYLE_TYPE_INT,
+        'border-right-width': STYLE_TYPE_INT,
+        'border-top-width': STYLE_TYPE_INT,
+        'border-bottom-width': STYLE_TYPE_INT
+    }
 
 
 class TextStyle(Style):
+    __slots__ = ()
+    TYPES = {
+        'italic': STYLE_TYPE_BOOLEAN,
+        'bold': STYLE_TYPE_BOOLEAN,
+        'underline': STYLE_TYPE_BOOLEAN,
+        'strikethrough': STYLE_TYPE_BOOLEAN,
+        'all-caps': STYLE_TYPE_BOOLEAN,
+        'small-caps': STYLE_TYPE_BOOLEAN,
+        'v-align': ['sup', 'sub', 'normal'],
+        'size': STYLE_TYPE_INT,
+        'font': ['sans', 'serif', 'mono', 'normal'],
+        'color': STYLE_TYPE_CDATA,
+        'background-color': STYLE_TYPE_CDATA
+    }
+
+
+_check_types(BlockStyle.TYPES)
+_check_types(TextStyle.TYPES)
+
+
+class StyleRegistry(object):
+    """The shared Style objects, one for each distinct style."""
     def __init__(self):
-        Style.__init__(self, {
-            'italic': STYLE_TYPE_BOOLEAN,
-            'bold': STYLE_TYPE_BOOLEAN,
-            'underline': STYLE_TYPE_BOOLEAN,
-            'strikethrough': STYLE_TYPE_BOOLEAN,
-            'all-caps': STYLE_TYPE_BOOLEAN,
-            'small-caps': STYLE_TYPE_BOOLEAN,
-            'v-align': ['sup', 'sub', 'normal'],
-            'size': STYLE_TYPE_INT,
-            'font': ['sans', 'serif', 'mono', 'normal'],
-            'color': STYLE_TYPE_CDATA,
-            'background-color': STYLE_TYPE_CDATA
-        })
+        object.__init__(self)
+        self.__styles = {}
+
+    def get(self, style_class, name=None, settings=None):
+        """The shared style of the class with the name and settings."""
+        key = (style_class, name, _convert_settings(style_class.TYPES, settings))
+        ret = self.__styles.get(key)
+        if ret is None:
+            ret = self.__styles.setdefault(key, style_class(name, key[2]))
+        return ret
+
+    def intern(self, style):
+        """The shared style equal to `style`."""
+        return self.get(type(style), style.name, style.get_settings())
+
+    def __len__(self):
+        return len(self.__styles)
+
+
+STYLES = StyleRegistry()
+
+
+def get_style(style_class, name=None, settings=None):
+    """The shared style from the STYLES registry."""
+    return STYLES.get(style_class, name, settings)
+
+
+def get_slot_values(obj):
+    """The values of the __slots__ attributes of the object, by name."""
+    ret = {}
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name.startswith('__') and not name.endswith('__'):
+                name = "_{0}{1}".format(cls.__name__.lstrip('_'), name)
+            if hasattr(obj, name):
+                ret[name] = getattr(obj, name)
+    return ret
+
+
+class Provenance(collections.namedtuple('Provenance', (
+        'paragraph', 'line', 'offset', 'style_name'))):
+    """
+    Where a content object came from in the input file: the ordinal of the
+    top-level paragraph it is part of, the line number and byte offset of
+    that paragraph in the source file (None when not known), and the name
+    of the object's style.  Used as the `source` of content objects, so
+    that they don't keep the parsed input alive.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        ret = "paragraph {0}".format(self.paragraph)
+        if self.line is not None:
+            ret += ", line {0}".format(self.line)
+        if self.style_name:
+            ret += " ({0})".format(self.style_name)
+        return ret
 
 
 class ContentObj(object):
+    # The content classes use __slots__, as a book has a great many of
+    # them.  Subclasses should declare their own attributes in __slots__
+    # as well.
+    __slots__ = ('source',)
+
     def __init__(self):
         object.__init__(self)
         self.source = None
@@ -120,34 +255,65 @@ class ContentObj(object):
 
 
 class Div(ContentObj):
-    """A block spacing object."""
+    """
+    A block spacing object.
+
+    get_text() is remembered until the children are changed through the
+    add_*() methods or by setting the list of children.  Code that changes
+    a child's text in place must call invalidate_text() on the divs that
+    contain it.
+    """
+    __slots__ = ('style', 'is_section', '__text')
+
     def __init__(self):
         ContentObj.__init__(self)
-        self.style = BlockStyle()
+        self.style = get_style(BlockStyle)
         self.is_section = False
+        self.__text = None
 
     def get_children(self):
         raise NotImplementedError()
 
     def get_text(self):
-        ret = ""
-        for ch in self.get_children():
-            ret += ch.get_text()
-        return ret
+        if self.__text is None:
+            self.__text = "".join([ch.get_text() for ch in self.get_children()])
+        return self.__text
+
+    def invalidate_text(self):
+        self.__text = None
+
+    def __getstate__(self):
+        # The remembered text is not pickled.
+        state = get_slot_values(self)
+        state['_Div__text'] = None
+        return None, state
 
 
 class SideBar(Div):
     """A side section of content."""
+    __slots__ = ('__divs',)
+
     def __init__(self):
         Div.__init__(self)
         self.divs = []
 
+    @property
+    def divs(self):
+        return self.__divs
+
+    @divs.setter
+    def divs(self, divs):
+        self.__divs = divs
+        self.invalidate_text()
+
     def get_children(self):
         return self.divs
 
 
 class SeparatorLine(Div):
     """A single line separating parts of a chapter."""
+    __slots__ = ()
+
     def __init__(self):
         Div.__init__(self)
 
@@ -156,13 +322,30 @@ class SeparatorLine(Div):
 
 
 class Para(Div):
+    __slots__ = ('__spans',)
+
     def __init__(self):
         Div.__init__(self)
         self.spans = []
 
+    @property
+    def spans(self):
+        return self.__spans
+
+    @spans.setter
+    def spans(self, spans):
+        self.__spans = spans
+        self.invalidate_text()
+
     def add_span(self, span):
         assert isinstance(span, Span), "not a span: {0}".format(span)
-        self.spans.append(span)
+        if isinstance(self.spans, list):
+            self.spans.append(span)
+            self.invalidate_text()
+        else:
+            # A tuple shared with other paragraphs (see Cleaner.clean_para);
+            # this paragraph gets its own list.
+            self.spans = list(self.spans) + [span]
 
     def get_children(self):
         return self.spans
@@ -182,24 +365,56 @@ class Para(Div):
 
 
 class TableRow(Div):
+    __slots__ = ('__cells',)
+
     def __init__(self):
         Div.__init__(self)
         self.cells = []
+
+    @property
+    def cells(self):
+        return self.__cells
+
+    @cells.setter
+    def cells(self, cells):
+        self.__cells = cells
+        self.invalidate_text()
     
     def add_cell(self, cell):
         assert isinstance(cell, Div)
         self.cells.append(cell)
+        self.invalidate_text()
 
     def get_children(self):
         return self.cells
 
 
 class Table(Div):
+    __slots__ = ('__header', '__rows')
+
     def __init__(self):
         Div.__init__(self)
         self.header = None
         self.rows = []
 
+    @property
+    def header(self):
+        return self.__header
+
+    @header.setter
+    def header(self, header):
+        self.__header = header
+        self.invalidate_text()
+
+    @property
+    def rows(self):
+        return self.__rows
+
+    @rows.setter
+    def rows(self, rows):
+        self.__rows = rows
+        self.invalidate_text()
+
     def set_header(self, header):
         assert header is None or isinstance(header, TableRow)
         self.header = header
@@ -207,6 +422,7 @@ class Table(Div):
     def add_row(self, row):
         assert isinstance(row, TableRow)
         self.rows.append(row)
+        self.invalidate_text()
 
     def get_children(self):
         ret = [self.header]
@@ -216,15 +432,19 @@ class Table(Div):
 
 class Span(ContentObj):
     """A inline object.  Contained in a Div"""
+    __slots__ = ('style',)
+
     def __init__(self):
         ContentObj.__init__(self)
-        self.style = TextStyle()
+        self.style = get_style(TextStyle)
 
     def get_text(self):
         return ""
 
 
 class Text(Span):
+    __slots__ = ('text',)
+
     def __init__(self):
         Span.__init__(self)
         self.text = ""
@@ -238,6 +458,8 @@ class Text(Span):
 
 
 class SpecialCharacter(Text):
+    __slots__ = ('html', 'is_whitespace')
+
     def __init__(self):
         Text.__init__(self)
         self.html = ""
@@ -245,6 +467,8 @@ class SpecialCharacter(Text):
 
 
 class Correction(Span):
+    __slots__ = ('original', 'text')
+
     def __init__(self, original):
         Span.__init__(self)
         self.original = original
@@ -252,6 +476,8 @@ class Correction(Span):
 
 
 class Media(Span):
+    __slots__ = ('filename', 'ext')
+
     def __init__(self, filename):
         Span.__init__(self)
         assert filename.find('.') >= 0
@@ -266,6 +492,8 @@ class Media(Span):
 
 
 class Image(Media):
+    __slots__ = ()
+
     def __init__(self, filename):
         Media.__init__(self, filename)
         assert filename.find('.') >= 0
@@ -280,6 +508,8 @@ class Image(Media):
 
 
 class Section(Div):
+    __slots__ = ('index', 'is_toc', 'is_book')
+
     def __init__(self, index):
         Div.__init__(self)
         self.is_section = True
@@ -292,20 +522,34 @@ class Section(Div):
 
 
 class Chapter(Section):
+    __slots__ = ('name', '__divs')
+
     def __init__(self, name, index):
         Section.__init__(self, index)
         self.name = name
         self.divs = []
 
+    @property
+    def divs(self):
+        return self.__divs
+
+    @divs.setter
+    def divs(self, divs):
+        self.__divs = divs
+        self.invalidate_text()
+
     def add_div(self, div):
         assert isinstance(div, Div)
         self.divs.append(div)
+        self.invalidate_text()
 
     def get_children(self):
         return self.divs
 
 
 class TOC(Section):
+    __slots__ = ('__title_div', 'depth_index_func', 'line_div_styles', '__section_tree')
+
     def __init__(self, index, depth_index_func):
         Section.__init__(self, index)
         self.is_toc = True
@@ -321,6 +565,24 @@ class TOC(Section):
         # A list of nodes
         self.section_tree = []
 
+    @property
+    def title_div(self):
+        return self.__title_div
+
+    @title_div.setter
+    def title_div(self, title_div):
+        self.__title_div = title_div
+        self.invalidate_text()
+
+    @property
+    def section_tree(self):
+        return self.__section_tree
+
+    @section_tree.setter
+    def section_tree(self, section_tree):
+        self.__section_tree = section_tree
+        self.invalidate_text()
+
     def get_children(self):
         ret = []
         if self.title_div is not None:
@@ -359,6 +621,8 @@ class TOC(Section):
 
 
 class TocRow(Div):
+    __slots__ = ('name', 'prefix', 'depth', 'index', 'text')
+
     def __init__(self, chapter, depth, index, prefix):
         Div.__init__(self)
         self.name = chapter.name
@@ -0,0 +1,63 @@
+"""
+Benchmark for Cleaner throughput on synthetic prose: plain text, and text
+full of quotes and dashes, in paragraphs of increasing length.  Also times
+a chapter of short, repeated paragraphs (the memo case).
+
+    python tests/bench_cleaner.py
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+from selfpub import text
+from selfpub.inp.cleaner import Cleaner
+
+
+PLAIN_WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'a', 'lazy', 'dog', 'and']
+QUOTED_WORDS = ['the', 'quick', 'brown', 'fox', '"Hello,"', "don't", '-', 'well', 'and',
+                'said', u'“yes”', "it's", 'jumps']
+REPEATED_PARAS = ['\t* * *', '\t"Yes."', '\t"No."', '\tHe nodded.', '\t"Why?"']
+
+# Total words cleaned for each paragraph length.
+WORDS_PER_RUN = 200000
+
+
+def make_para(val):
+    ret = text.Para()
+    span = text.Text()
+    span.text = val
+    ret.add_span(span)
+    return ret
+
+
+def clean_all(paras):
+    cleaner = Cleaner(None, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for para in paras:
+            cleaner.clean_section(para)
+        return time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(1)
+    for name, words in (("plain", PLAIN_WORDS), ("quoted", QUOTED_WORDS)):
+        for length in (50, 500, 5000):
+            paras = [
+                make_para('\tThe ' + ' '.join(rng.choice(words) for i in range(length)))
+                for j in range(max(1, WORDS_PER_RUN // length))]
+            size = sum(len(para.spans[0].text) for para in paras)
+            took = clean_all(paras)
+            print("{0:6s} {1:5d} words/paragraph: {2:.2f} MB/s".format(
+                name, length, size / took / 1e6))
+    paras = [make_para(rng.choice(REPEATED_PARAS)) for i in range(50000)]
+    print("50000 short repeated paragraphs: {0:.3f}s".format(clean_all(paras)))
+
+
+if __name__ == '__main__':
+    main()
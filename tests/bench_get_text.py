@@ -0,0 +1,65 @@
+"""
+Benchmark for Div.get_text() on a chapter of N paragraphs of 8 spans.
+"First" is the first get_text() of a new chapter; "pipeline" is each
+paragraph's text twice, then the chapter's text 5 times, as the cleaner
+and style sheet ask for it.
+
+    python tests/bench_get_text.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+from selfpub import text
+
+
+WORDS = "the quick brown fox jumps over a lazy dog and then".split()
+
+
+def make_chapter(paras):
+    ret = text.Chapter("c", 1)
+    for p in range(paras):
+        para = text.Para()
+        for s in range(4):
+            span = text.Text()
+            span.text = " ".join(WORDS[(p + s) % 5:(p + s) % 5 + 6]) + " "
+            para.add_span(span)
+            special = text.SpecialCharacter()
+            special.text = u"“"
+            para.add_span(special)
+        ret.add_div(para)
+    return ret
+
+
+def best_of(count, func):
+    ret = None
+    for i in range(count):
+        start = time.perf_counter()
+        func()
+        took = time.perf_counter() - start
+        if ret is None or took < ret:
+            ret = took
+    return ret
+
+
+def main():
+    for paras in (500, 2000, 8000):
+        chapters = iter([make_chapter(paras) for i in range(3)])
+        first = best_of(3, lambda: next(chapters).get_text())
+
+        chapter = make_chapter(paras)
+
+        def pipeline():
+            for para in chapter.divs:
+                para.get_text()
+                para.get_text()
+            for i in range(5):
+                chapter.get_text()
+        print("{0:5d} paragraphs: first {1:.2f}ms, pipeline {2:.2f}ms".format(
+            paras, first * 1000, best_of(3, pipeline) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark for Cleaner.lint() against a full clean, on a document of 20k
+paragraphs with quotes and spans.  Each mode reads the ODT file from the
+start: lint with and without lazy_paras, and parsing plus cleaning every
+section.  The peak is the most memory allocated at once (from tracemalloc,
+in a separate run).
+
+    python tests/bench_lint.py
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+from selfpub.inp import Cleaner, ODTInputFile
+import sample_docs
+
+
+PARAGRAPHS = 20000
+
+WORDS = "the quick brown fox jumps over a lazy dog and then it's".split()
+
+
+def make_body(count):
+    """Paragraphs of different text, so that the Cleaner's memo doesn't
+    help, with a heading every 300."""
+    rng = random.Random(1)
+    ret = []
+    for i in range(count):
+        if i % 300 == 0:
+            ret.append('<text:h text:style-name="Heading" text:outline-level="1">'
+                       'Chapter {0}</text:h>'.format(i // 300 + 1))
+        else:
+            ret.append('<text:p text:style-name="P1"><text:tab/>"{0}," she said - '
+                       '<text:span text:style-name="T1">it\'s</text:span> {1}.</text:p>'.format(
+                           " ".join(rng.choice(WORDS) for j in range(8)),
+                           " ".join(rng.choice(WORDS) for j in range(30))))
+    return ret
+
+
+def lint(filename, lazy_paras):
+    count = 0
+    for issue in Cleaner(None, ODTInputFile(filename, None, lazy_paras=lazy_paras)).lint():
+        count += 1
+    return count
+
+
+def clean(filename):
+    count = 0
+    for sec in Cleaner(None, ODTInputFile(filename, None)).sections():
+        count += 1
+    return count
+
+
+def measure(func):
+    """The time, and the peak traced memory, of calling func."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func()
+        took = time.perf_counter() - start
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return took, peak
+
+
+def main():
+    body = make_body(PARAGRAPHS)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bench.odt")
+        sample_docs.write_odt(filename, body)
+        for name, func in (
+                ("lint, lazy_paras", lambda: lint(filename, True)),
+                ("lint", lambda: lint(filename, False)),
+                ("parse and clean", lambda: clean(filename))):
+            took, peak = measure(func)
+            print("{0:18s} {1:.2f}s, peak {2:.1f} MB".format(name, took, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark for the memory used by the text nodes of a synthetic book:
+40 chapters of 300 paragraphs, each with text, special character and
+correction spans.
+
+    python tests/bench_memory.py
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+from selfpub import text
+
+
+WORDS = "the quick brown fox jumps over a lazy dog and then".split()
+
+
+def build(chapters=40, paras=300):
+    """Return the chapters and the number of nodes in them."""
+    book = []
+    count = 0
+    for c in range(chapters):
+        chapter = text.Chapter("Chapter {0}".format(c), c)
+        count += 1
+        for p in range(paras):
+            para = text.Para()
+            para.source = text.Provenance(p, None, None, "P1")
+            count += 1
+            for s in range(4):
+                span = text.Text()
+                span.text = " ".join(WORDS[(p + s) % 5:(p + s) % 5 + 3]) + " "
+                para.add_span(span)
+                special = text.SpecialCharacter()
+                special.text = u"“"
+                special.html = "&ldquo;"
+                para.add_span(special)
+                count += 2
+            para.add_span(text.Correction('"'))
+            count += 1
+            chapter.add_div(para)
+        book.append(chapter)
+    return book, count
+
+
+def shallow_size(obj):
+    """The size of the object, and of its __dict__ if it has one."""
+    ret = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        ret += sys.getsizeof(obj.__dict__)
+    return ret
+
+
+def main():
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    book, count = build()
+    gc.collect()
+    total = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    sizes = {}
+    for chapter in book:
+        sizes.setdefault('Chapter', shallow_size(chapter))
+        for para in chapter.divs:
+            sizes.setdefault('Para', shallow_size(para))
+            for span in para.spans:
+                sizes.setdefault(type(span).__name__, shallow_size(span))
+    print("{0} nodes, {1:.1f} bytes per node (with styles, text and lists)".format(
+        count, total / count))
+    for name in sorted(sizes):
+        print("  {0:18s} {1} bytes".format(name, sizes[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for parsing ODT elements into text nodes (ContentFile.convert_node)
+on synthetic documents: many flat paragraphs, and paragraphs of deeply
+nested spans.  The elements are built first (with an ElementStream, as
+minidom can't parse the deepest ones), so only the conversion is timed.
+
+    python tests/bench_parse.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+from selfpub.inp import odt
+import sample_docs
+
+
+# (name, plain paragraphs, nested paragraphs, nesting depth)
+DOCUMENTS = (
+    ("200 paragraphs, 300 nested spans", 200, 10, 300),
+    ("100 paragraphs, 900 nested spans", 100, 10, 900),
+    ("3 paragraphs, 2000 nested spans", 3, 1, 2000),
+    ("20k flat paragraphs", 20000, 0, 0),
+)
+
+
+def make_body(plain, nested, depth):
+    ret = [sample_docs.SPAN_PARA] * plain
+    for i in range(nested):
+        ret.append('<text:p text:style-name="P1">' +
+                   '<text:span text:style-name="T1">' * depth + 'deep text' +
+                   '</text:span>' * depth + '</text:p>')
+    return ret
+
+
+def make_odt(body):
+    data = io.BytesIO()
+    sample_docs.write_odt(data, body)
+    data.seek(0)
+    return odt.parse_zip(zipfile.ZipFile(data, 'r'))
+
+
+def get_text_elements(body):
+    elements = odt.ElementStream(
+        io.BytesIO(sample_docs.content_xml(body).encode()), (), ("office:text",))
+    return [child for parent, child, line, offset in elements.elements()]
+
+
+def best_of(count, func):
+    ret = None
+    for i in range(count):
+        start = time.perf_counter()
+        func()
+        took = time.perf_counter() - start
+        if ret is None or took < ret:
+            ret = took
+    return ret
+
+
+def main():
+    for name, plain, nested, depth in DOCUMENTS:
+        body = make_body(plain, nested, depth)
+        content = make_odt(body).content
+        nodes = get_text_elements(body)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Loads the automatic styles.
+            for node in content.stream():
+                pass
+
+            def convert():
+                for node in nodes:
+                    content.convert_node(node)
+            took = best_of(3, convert)
+        print("{0:34s} {1:.3f}s".format(name, took))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Small synthetic ODT and flat ODT documents for the tests and benchmarks.
+The body is a list of the XML of the top-level <office:text> elements.
+"""
+
+import base64
+import zipfile
+
+
+NAMESPACES = (
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+    'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+    'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    'xmlns:meta="urn:oasis:names:tc:opendocument:xmlns:meta:1.0"')
+
+STYLES = (
+    '<office:styles>'
+    '<style:default-style style:family="paragraph">'
+    '<style:text-properties fo:font-size="12pt"/></style:default-style>'
+    '<style:style style:name="Standard" style:family="paragraph"/>'
+    '<style:style style:name="Heading" style:family="paragraph" '
+    'style:parent-style-name="Standard">'
+    '<style:text-properties fo:font-weight="bold"/></style:style>'
+    '<style:style style:name="Emphasis" style:family="text">'
+    '<style:text-properties fo:font-style="italic"/></style:style>'
+    '</office:styles>')
+
+AUTOMATIC_STYLES = (
+    '<office:automatic-styles>'
+    '<style:style style:name="P1" style:family="paragraph" '
+    'style:parent-style-name="Standard"/>'
+    '<style:style style:name="T1" style:family="text">'
+    '<style:text-properties fo:font-weight="bold"/></style:style>'
+    '</office:automatic-styles>')
+
+META = (
+    '<office:meta><dc:title>Sample</dc:title>'
+    '<meta:user-defined meta:name="Book Author">Jane Q Doe</meta:user-defined>'
+    '</office:meta>')
+
+MANIFEST_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?><manifest:manifest '
+    'xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0"/>')
+
+PLAIN_PARA = '<text:p text:style-name="P1"><text:tab/>"Plain," she said.</text:p>'
+
+SPAN_PARA = (
+    '<text:p text:style-name="P1"><text:tab/>"Hello," she said - '
+    '<text:span text:style-name="T1">it\'s</text:span><text:s/> a '
+    '<text:span text:style-name="Emphasis">nice</text:span> day.</text:p>')
+
+# Not a real PNG; nothing reads it.
+IMAGE_NAME = "Pictures/image1.png"
+IMAGE_DATA = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+
+IMAGE_XML = '<draw:image xlink:href="' + IMAGE_NAME + '"/>'
+
+# The same image, as a flat file has it.
+EMBEDDED_IMAGE_XML = (
+    '<draw:image draw:mime-type="image/png"><office:binary-data>' +
+    base64.encodebytes(IMAGE_DATA).decode() +
+    '</office:binary-data></draw:image>')
+
+IMAGE_PARA = (
+    '<text:p text:style-name="P1"><text:tab/>"Look," she said - '
+    '<draw:frame draw:name="Image1">' + IMAGE_XML + '</draw:frame>'
+    ' it\'s here.</text:p>')
+
+SAMPLE_BODY = [
+    '<text:sequence-decls/>',
+    '<text:h text:style-name="Heading" text:outline-level="1">Chapter 1</text:h>',
+    PLAIN_PARA,
+    SPAN_PARA,
+    '<text:p text:style-name="P1">* * *</text:p>',
+    '<text:p text:style-name="P1"><text:tab/>Two<text:line-break/>lines'
+    '<text:soft-page-break/> and <text:span text:style-name="T1">'
+    '<text:span text:style-name="Emphasis">nested</text:span> spans</text:span>.</text:p>',
+    '<text:list><text:p text:style-name="P1">A list &amp; stuff</text:p></text:list>',
+    # A space before a closing quote, and a space (an empty span) before
+    # the text.
+    '<text:p text:style-name="P1"><text:tab/>"Wait, " he said, "not yet. "</text:p>',
+    '<text:p text:style-name="P1"><text:span text:style-name="T1"><text:s/></text:span>'
+    'Indented with a space.</text:p>',
+    '<text:h text:style-name="Heading" text:outline-level="1">Chapter 2</text:h>',
+    PLAIN_PARA,
+    SPAN_PARA,
+]
+
+# The sample, with an inline image.
+IMAGE_BODY = SAMPLE_BODY[:4] + [IMAGE_PARA] + SAMPLE_BODY[4:] + [IMAGE_PARA]
+
+
+def content_xml(body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<office:document-content ' + NAMESPACES + '>' + AUTOMATIC_STYLES +
+        '<office:body><office:text>' + "".join(body) +
+        '</office:text></office:body></office:document-content>')
+
+
+def styles_xml():
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-styles ' + NAMESPACES + '>' + STYLES +
+            '</office:document-styles>')
+
+
+def meta_xml():
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-meta ' + NAMESPACES + '>' + META +
+            '</office:document-meta>')
+
+
+def write_odt(dest, body=SAMPLE_BODY):
+    """Write an ODT package to `dest`, a filename or a binary stream."""
+    with zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr("META-INF/manifest.xml", MANIFEST_XML)
+        z.writestr("content.xml", content_xml(body))
+        z.writestr("styles.xml", styles_xml())
+        z.writestr("meta.xml", meta_xml())
+        z.writestr(IMAGE_NAME, IMAGE_DATA)
+
+
+def write_fodt(filename, body=SAMPLE_BODY, image_xml=EMBEDDED_IMAGE_XML):
+    """Write the same document as a flat ODT file, with `image_xml` in
+    place of the linked image."""
+    body = [val.replace(IMAGE_XML, image_xml) for val in body]
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>'
+                '<office:document ' + NAMESPACES + '>' + META + STYLES +
+                AUTOMATIC_STYLES + '<office:body><office:text>' + "".join(body) +
+                '</office:text></office:body></office:document>')
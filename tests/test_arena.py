@@ -0,0 +1,162 @@
+"""
+Tests for the DocumentArena, against the object tree it was built from.
+"""
+
+import contextlib
+import io
+import pickle
+import pytest
+from selfpub import arena, text
+from selfpub.inp import Cleaner, ODTInputFile
+import sample_docs
+
+
+# The text classes, subclasses first.
+TEXT_CLASSES = (
+    text.Chapter, text.SideBar, text.Para, text.SeparatorLine,
+    text.SpecialCharacter, text.Text, text.Correction, text.Media,
+)
+
+# NODE_* kind -> the objects of that kind.
+KIND_TESTS = (
+    (arena.NODE_CHAPTER, lambda obj: isinstance(obj, text.Chapter)),
+    (arena.NODE_SIDEBAR, lambda obj: isinstance(obj, text.SideBar)),
+    (arena.NODE_PARA, lambda obj: isinstance(obj, text.Para)),
+    (arena.NODE_SEPARATOR, lambda obj: isinstance(obj, text.SeparatorLine)),
+    (arena.NODE_TEXT, lambda obj: type(obj) is text.Text),
+    (arena.NODE_SPECIAL, lambda obj: (
+        isinstance(obj, text.SpecialCharacter) and not obj.is_whitespace)),
+    (arena.NODE_SPECIAL_WHITESPACE, lambda obj: (
+        isinstance(obj, text.SpecialCharacter) and obj.is_whitespace)),
+    (arena.NODE_CORRECTION, lambda obj: isinstance(obj, text.Correction)),
+    (arena.NODE_MEDIA, lambda obj: isinstance(obj, text.Media)),
+)
+
+
+def read_sections(tmp_path, body):
+    """The cleaned sample document, in two chapters, then a separator and
+    two paragraphs with other sources."""
+    odt_file = str(tmp_path / "sample.odt")
+    sample_docs.write_odt(odt_file, body)
+    # Without the memo, every span has the source the parser gave it.
+    inp = Cleaner(None, ODTInputFile(odt_file, None), memo_length=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = list(inp.sections())
+    half = len(sections) // 2
+    ret = []
+    for index, divs in enumerate((sections[:half], sections[half:])):
+        chapter = text.Chapter("Chapter {0}".format(index + 1), index)
+        for div in divs:
+            chapter.add_div(div)
+        ret.append(chapter)
+    separator = text.SeparatorLine()
+    separator.source = text.Provenance(6, 20, 400, "P1")
+    ret.append(separator)
+    for source in (text.Provenance(7, None, None, None), None):
+        para = text.Para()
+        para.source = source
+        span = text.Text()
+        span.text = "The end."
+        if source is not None:
+            # As the parser does it.
+            span.source = source._replace(style_name=span.style.name)
+        para.add_span(span)
+        ret.append(para)
+    return ret
+
+
+@pytest.fixture
+def sections(tmp_path):
+    return read_sections(tmp_path, sample_docs.IMAGE_BODY)
+
+
+def get_children(obj):
+    if isinstance(obj, text.Para):
+        return obj.spans
+    if isinstance(obj, text.Chapter) or isinstance(obj, text.SideBar):
+        return obj.divs
+    return []
+
+
+def walk(objs):
+    """The objects and everything in them, in document order."""
+    for obj in objs:
+        yield obj
+        for val in walk(get_children(obj)):
+            yield val
+
+
+def describe(obj):
+    """What a view has to match: the text class, style, text, html,
+    original, source and children."""
+    ret = [[cls for cls in TEXT_CLASSES if isinstance(obj, cls)][0].__name__,
+           obj.style, obj.source]
+    if isinstance(obj, text.Media):
+        ret.append(obj.filename)
+    else:
+        ret.append(obj.get_text())
+    if isinstance(obj, text.Chapter):
+        ret.extend((obj.name, obj.index))
+    if isinstance(obj, text.SpecialCharacter):
+        ret.extend((obj.text, obj.html, obj.is_whitespace))
+    elif isinstance(obj, text.Text):
+        ret.append(obj.text)
+    elif isinstance(obj, text.Correction):
+        ret.append(obj.original)
+    ret.append([describe(child) for child in get_children(obj)])
+    return ret
+
+
+def test_views_match_objects(sections):
+    store = arena.from_sections(sections)
+    assert [describe(view) for view in store.sections()] == [
+        describe(sec) for sec in sections]
+    kinds = set(store.get_kind(node) for node in range(len(store)))
+    assert kinds.issuperset((arena.NODE_CHAPTER, arena.NODE_SIDEBAR, arena.NODE_PARA,
+                             arena.NODE_SEPARATOR, arena.NODE_CORRECTION, arena.NODE_MEDIA))
+
+
+def test_sources(sections):
+    store = arena.from_sections(sections)
+    objs = list(walk(sections))
+    assert len(objs) == len(store)
+    for node, obj in enumerate(objs):
+        assert store.get_source(node) == obj.source, node
+    assert store.get_source(len(store) - 5) == text.Provenance(6, 20, 400, "P1")
+    assert store.get_source(len(store) - 4) == text.Provenance(7, None, None, None)
+    assert store.get_source(len(store) - 2) is None
+    # Only the divs' sources take up rows.
+    assert len(store.source_paragraphs) < len(store) // 2
+
+
+def test_iter_kind_and_text(sections):
+    store = arena.from_sections(sections)
+    objs = list(walk(sections))
+    for kind, test in KIND_TESTS:
+        expected = [node for node, obj in enumerate(objs) if test(obj)]
+        assert list(store.iter_kind((kind,))) == expected, kind
+        assert list(store.iter_text((kind,))) == [objs[node].get_text() for node in expected]
+    spans = (arena.NODE_TEXT, arena.NODE_SPECIAL, arena.NODE_SPECIAL_WHITESPACE)
+    assert "".join(store.iter_text(spans)) == store.text
+
+
+def test_children_and_ends(sections):
+    store = arena.from_sections(sections)
+    objs = list(walk(sections))
+    assert [objs[node] for node in store.top_level()] == sections
+    for node, obj in enumerate(objs):
+        children = store.get_children(node)
+        assert [objs[child] for child in children] == list(get_children(obj))
+        for child in children:
+            assert store.get_parent(child) == node
+        assert store.ends[node] == node + 1 + len(list(walk(get_children(obj))))
+
+
+def test_pickle(tmp_path):
+    # The images refer to the open input file, so are left out.
+    sections = read_sections(tmp_path, sample_docs.SAMPLE_BODY)
+    store = arena.from_sections(sections)
+    copy = pickle.loads(pickle.dumps(store))
+    assert [describe(view) for view in copy.sections()] == [
+        describe(sec) for sec in sections]
+    assert copy.text == store.text
@@ -0,0 +1,73 @@
+"""
+Tests for the parse cache.
+"""
+
+import contextlib
+import io
+import os
+import zlib
+import pytest
+from selfpub.inp import ODTInputFile, ParseCache
+import sample_docs
+
+
+def read(filename, cache):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [sec.get_text() for sec in ODTInputFile(filename, None, cache=cache).sections()]
+
+
+def cache_files(directory):
+    return sorted(os.listdir(directory))
+
+
+@pytest.mark.parametrize("damaged", [
+    b"not compressed",
+    zlib.compress(b"not a pickle"),
+    zlib.compress(b"\x80\x04\x95"),
+])
+def test_damaged_entry_is_parsed_again(tmp_path, damaged):
+    odt_file = str(tmp_path / "sample.odt")
+    sample_docs.write_odt(odt_file)
+    directory = str(tmp_path / "cache")
+    cache = ParseCache(directory)
+    expected = read(odt_file, cache)
+    names = cache_files(directory)
+    assert len(names) == 1
+
+    with open(os.path.join(directory, names[0]), "wb") as f:
+        f.write(damaged)
+    assert read(odt_file, cache) == expected
+    # The entry was written again.
+    assert cache_files(directory) == names
+    hits = cache.hits
+    assert read(odt_file, cache) == expected
+    assert cache.hits == hits + 1
+
+
+def test_put_leaves_no_temp_files(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.put("key", b"data")
+    cache.put("key", b"other data")
+    assert cache_files(str(tmp_path)) == ["key.parsed"]
+    assert cache.get("key") == b"other data"
+
+
+def read_sources(filename, cache, streaming):
+    inp = ODTInputFile(filename, None, streaming=streaming, cache=cache)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [sec.source for sec in inp.sections()]
+
+
+def test_streaming_and_dom_entries(tmp_path):
+    # The streamed sections have the line and offset in their sources.
+    odt_file = str(tmp_path / "sample.odt")
+    sample_docs.write_odt(odt_file)
+    cache = ParseCache(str(tmp_path / "cache"))
+    expected = {}
+    for streaming in (True, False):
+        expected[streaming] = read_sources(odt_file, None, streaming)
+    assert expected[True] != expected[False]
+    for run in range(2):
+        for streaming in (True, False):
+            assert read_sources(odt_file, cache, streaming) == expected[streaming]
+    assert (cache.misses, cache.hits) == (2, 2)
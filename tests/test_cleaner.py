@@ -0,0 +1,311 @@
+"""
+Tests for the Cleaner.
+
+data/cleaner_golden.json is a corpus of random paragraphs (quotes, dashes,
+unicode spaces, images), with the spans that the original, one character
+at a time, Cleaner made from them.  The only difference from the original
+is a dash at the very start of a paragraph, which used to raise IndexError;
+those cases have the current output.  Paragraphs where an image ends up
+last are left out, as the Cleaner raises AttributeError on them (it always
+has).
+
+Running this file as a script (with src on the PYTHONPATH) writes a new
+corpus from the current Cleaner.  Only do that when the output is meant to
+change.
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import pytest
+from selfpub import text
+from selfpub.inp import InputFile, ODTInputFile
+from selfpub.inp.cache import CleanCache
+from selfpub.inp.cleaner import Cleaner, iter_paras
+import sample_docs
+
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), "data", "cleaner_golden.json")
+GOLDEN_SEED = 15
+GOLDEN_COUNT = 400
+
+# What the random paragraphs are made of.
+FUZZ_PIECES = [
+    'a', 'b', 'word', ' ', '  ', '\t', u'\u00A0', u'\u200B', u'\u3000', '-',
+    u'\u2013', '"', u'\u201C', u'\u201D', "'", u'\u2018', u'\u2019', '*', '&',
+    '<', '\n', 'x.', ' - ', ' " ',
+]
+
+
+def make_corpus_inputs(seed=GOLDEN_SEED, count=GOLDEN_COUNT):
+    """Random paragraphs, as {"tab": bool, "spans": [text or None]}; None
+    is an image."""
+    rng = random.Random(seed)
+    ret = []
+    for i in range(count):
+        spans = []
+        for j in range(rng.randrange(1, 5)):
+            if rng.random() < 0.1:
+                spans.append(None)
+            else:
+                spans.append("".join(
+                    rng.choice(FUZZ_PIECES) for k in range(rng.randrange(0, 30))))
+        ret.append({"tab": rng.random() < 0.5, "spans": spans})
+    return ret
+
+
+def make_para(spans):
+    ret = text.Para()
+    for val in spans:
+        if val is None:
+            ret.add_span(text.Image("a.png"))
+        else:
+            span = text.Text()
+            span.text = val
+            ret.add_span(span)
+    return ret
+
+
+def describe(node):
+    """The cleaned node as JSON-compatible lists."""
+    if node is None:
+        return None
+    if isinstance(node, text.Para):
+        return ["Para", [describe_span(span) for span in node.spans]]
+    return [type(node).__name__]
+
+
+def describe_span(span):
+    if isinstance(span, text.SpecialCharacter):
+        return ["Special", span.text, span.html, span.is_whitespace]
+    if isinstance(span, text.Correction):
+        return ["Correction", span.original]
+    if isinstance(span, text.Text):
+        return ["Text", span.text]
+    return [type(span).__name__]
+
+
+def clean(cleaner, case):
+    cleaner.expect_paragraphs_to_start_with_tab = case["tab"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return describe(cleaner.clean_section(make_para(case["spans"])))
+
+
+def render(para):
+    """The cleaned paragraph as html-ish text: special characters as their
+    html, corrections left out."""
+    ret = []
+    for span in para.spans:
+        if isinstance(span, text.SpecialCharacter):
+            ret.append(span.html)
+        elif isinstance(span, text.Text):
+            ret.append(span.text)
+    return "".join(ret)
+
+
+def clean_text(val, tab=True):
+    cleaner = Cleaner(None, None)
+    cleaner.expect_paragraphs_to_start_with_tab = tab
+    with contextlib.redirect_stdout(io.StringIO()):
+        return cleaner.clean_section(make_para([val]))
+
+
+def load_golden():
+    with open(GOLDEN_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_golden_corpus():
+    for i, case in enumerate(load_golden()):
+        assert clean(Cleaner(None, None), case) == case["expected"], "case {0}: {1!r}".format(
+            i, case["spans"])
+
+
+def test_golden_corpus_shared_cleaner():
+    # One Cleaner for every paragraph, twice over, so the short paragraph
+    # memo is used.
+    cleaner = Cleaner(None, None)
+    golden = load_golden()
+    for i, case in enumerate(golden + golden):
+        assert clean(cleaner, case) == case["expected"], "case {0}: {1!r}".format(
+            i % len(golden), case["spans"])
+    assert cleaner.get_memo_hit_rate() > 0
+
+
+def test_golden_corpus_clean_cache(tmp_path):
+    # The first pass cleans the paragraphs and stores them in the cache,
+    # the second reads them back.  (The memo is off, so every paragraph
+    # goes through the cache.)
+    cache = CleanCache(str(tmp_path))
+    golden = load_golden()
+    for run in range(2):
+        hits = cache.hits
+        cleaner = Cleaner(None, None, cache=cache, memo_size=0)
+        for i, case in enumerate(golden):
+            assert clean(cleaner, case) == case["expected"], "run {0}, case {1}: {2!r}".format(
+                run, i, case["spans"])
+        cache.flush()
+    assert cache.hits - hits == len(golden)
+
+
+def test_memo_shared_spans_can_be_added_to():
+    cleaner = Cleaner(None, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = cleaner.clean_section(make_para(['\t"Yes."']))
+        second = cleaner.clean_section(make_para(['\t"Yes."']))
+    assert cleaner.memo_hits == 1
+    assert first.spans is second.spans
+    first.add_span(text.Image("a.png"))
+    assert len(first.spans) == len(second.spans) + 1
+    assert render(second) == '&ldquo;Yes.&rdquo;'
+
+
+def test_memo_uses_the_whole_style():
+    cleaner = Cleaner(None, None)
+    plain = make_para(['\t"Yes."'])
+    bold = make_para(['\t"Yes."'])
+    bold.spans[0].style = bold.spans[0].style.with_setting('bold', True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        plain = cleaner.clean_section(plain)
+        bold = cleaner.clean_section(bold)
+    assert cleaner.memo_hits == 0
+    assert plain.spans[-1].style.get_setting('bold') is not True
+    assert bold.spans[-1].style.get_setting('bold') is True
+
+
+HAND_CASES = [
+    # (input, expected render(), with a tab)
+    ('\t"Hello," she said.', '&ldquo;Hello,&rdquo; she said.'),
+    ("\tIt's done.", 'It&rsquo;s done.'),
+    ("\tHe said 'no' then.", 'He said &lsquo;no&rsquo; then.'),
+    ("\tWait - what?", 'Wait&nbsp;&ndash; what?'),
+    ("\tA  lot   of space.", 'A lot of space.'),
+    ("\tTrailing space.  ", 'Trailing space.'),
+]
+
+
+def test_hand_cases():
+    for val, expected in HAND_CASES:
+        para = clean_text(val)
+        assert isinstance(para, text.Para), val
+        assert render(para) == expected, val
+
+
+def test_empty_paragraph_is_removed():
+    assert clean_text("\t   ") is None
+
+
+class SectionsInput(InputFile):
+    def __init__(self, sections):
+        InputFile.__init__(self)
+        self.__sections = sections
+
+    def sections(self):
+        return iter(self.__sections)
+
+
+def read_image_sections(tmp_path):
+    """The sample document with images: as SideBars (as the ODT reader
+    makes them), and inline in each paragraph."""
+    odt_file = str(tmp_path / "images.odt")
+    sample_docs.write_odt(odt_file, sample_docs.IMAGE_BODY)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ret = list(ODTInputFile(odt_file, None).sections())
+    for sec in ret:
+        if isinstance(sec, text.Para) and len(sec.spans) > 1:
+            image = text.Image("inline.png")
+            image.source = sec.source
+            sec.spans.insert(1, image)
+            sec.invalidate_text()
+    return ret
+
+
+def describe_section(node):
+    ret = [type(node).__name__, node.style.name]
+    if isinstance(node, text.Para):
+        ret.append([describe_section(span) for span in node.spans])
+    elif isinstance(node, text.SideBar) or isinstance(node, text.Chapter):
+        ret.append([describe_section(div) for div in node.divs])
+    elif isinstance(node, text.Media):
+        ret.append(node.filename)
+    else:
+        ret.extend(describe_span(node)[1:])
+    return ret
+
+
+def test_parallel_with_images(tmp_path):
+    cleaned = []
+    for parallel in (False, True):
+        cleaner = Cleaner(None, SectionsInput(read_image_sections(tmp_path)),
+                          parallel=parallel, workers=2, batch_size=2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cleaned.append([describe_section(sec) for sec in cleaner.sections()])
+    assert cleaned[1] == cleaned[0]
+    assert "inline.png" in repr(cleaned[0])
+    assert "Pictures/image1.png" in repr(cleaned[0])
+
+
+class TabWarningCleaner(Cleaner):
+    """Records the paragraphs of the tab warnings."""
+    def __init__(self, md, proxy, **kwargs):
+        Cleaner.__init__(self, md, proxy, **kwargs)
+        self.tab_warnings = []
+
+    def check_para_start(self, span):
+        if len(span.text) > 0 and span.text[0] != '\t':
+            self.tab_warnings.append(span.source.paragraph)
+
+
+def is_dropped_correction(issue):
+    """The space before a closing double quote: the clean records a
+    Correction for it, then strips it off with the whitespace."""
+    return issue.rule == "double-quote" and issue.original.startswith(" ")
+
+
+@pytest.mark.parametrize("lazy_paras", [False, True])
+def test_lint_matches_clean(tmp_path, lazy_paras):
+    odt_file = str(tmp_path / "sample.odt")
+    sample_docs.write_odt(odt_file)
+    # Without the memo, so that each Correction has its own paragraph's
+    # source.
+    cleaner = TabWarningCleaner(None, ODTInputFile(odt_file, None), memo_length=0)
+    corrections = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for sec in cleaner.sections():
+            for para in iter_paras(sec):
+                corrections.extend(
+                    (para.source.paragraph, span.original) for span in para.spans
+                    if isinstance(span, text.Correction))
+        issues = list(Cleaner(None, ODTInputFile(
+            odt_file, None, lazy_paras=lazy_paras)).lint())
+
+    assert [issue.paragraph for issue in issues
+            if issue.rule == "paragraph-start"] == cleaner.tab_warnings
+    assert [(issue.paragraph, issue.original) for issue in issues
+            if issue.rule != "paragraph-start" and
+            not is_dropped_correction(issue)] == corrections
+    assert len([issue for issue in issues if is_dropped_correction(issue)]) == 2
+    assert len(corrections) > 5
+    assert len(cleaner.tab_warnings) > 3
+
+
+def main():
+    cases = []
+    for case in make_corpus_inputs():
+        try:
+            case["expected"] = clean(Cleaner(None, None), case)
+        except AttributeError:
+            continue
+        cases.append(case)
+    # One case per line, so that changes are easy to review.
+    with open(GOLDEN_FILE, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(case) for case in cases))
+        f.write("\n]\n")
+    print("Wrote {0} cases to {1}".format(len(cases), GOLDEN_FILE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Tests for the flat ODT reader, against the zip ODT reader on the same
+document.
+"""
+
+import contextlib
+import io
+import pytest
+from selfpub import text
+from selfpub.inp import Cleaner, FlatODTInputFile, ODTInputFile
+import sample_docs
+
+
+@pytest.fixture
+def docs(tmp_path):
+    odt_file = str(tmp_path / "sample.odt")
+    fodt_file = str(tmp_path / "sample.fodt")
+    sample_docs.write_odt(odt_file)
+    sample_docs.write_fodt(fodt_file)
+    return odt_file, fodt_file
+
+
+def describe(node):
+    """The node, and everything in it, as nested lists."""
+    name = type(node).__name__
+    if name == 'LazyPara':
+        name = 'Para'
+    elif isinstance(node, text.Image):
+        # An OdtImage, or an EmbeddedImage in a flat file.
+        name = 'Image'
+    ret = [name, node.style.name]
+    if isinstance(node, text.Para):
+        ret.append([describe(span) for span in node.spans])
+    elif isinstance(node, text.SideBar) or isinstance(node, text.Chapter):
+        ret.append([describe(div) for div in node.divs])
+    elif isinstance(node, text.SpecialCharacter):
+        ret.extend((node.text, node.html))
+    elif isinstance(node, text.Text):
+        ret.append(node.text)
+    return ret
+
+
+def read(inp, clean=False):
+    if clean:
+        inp = Cleaner(None, inp)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [describe(sec) for sec in inp.sections()]
+
+
+def find_images(sections):
+    ret = []
+    for sec in sections:
+        if isinstance(sec, text.SideBar):
+            ret.extend(div for div in sec.divs if isinstance(div, text.Image))
+    return ret
+
+
+def save(image):
+    out = io.BytesIO()
+    image.save_as(out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("lazy_paras", [False, True])
+@pytest.mark.parametrize("clean", [False, True])
+def test_same_as_odt(docs, lazy_paras, clean):
+    odt_file, fodt_file = docs
+    expected = read(ODTInputFile(odt_file, None), clean)
+    flat = FlatODTInputFile(fodt_file, None, lazy_paras=lazy_paras)
+    assert flat.lazy_paras == lazy_paras
+    assert read(flat, clean) == expected
+    assert len(expected) > 5
+
+
+def test_lazy_paras(docs):
+    odt_file, fodt_file = docs
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = list(FlatODTInputFile(fodt_file, None, lazy_paras=True).sections())
+    assert any(type(sec).__name__ == 'LazyPara' for sec in sections)
+
+
+def test_lazy_paras_must_match(docs):
+    odt_file, fodt_file = docs
+    flat = FlatODTInputFile(fodt_file, None)
+    with pytest.raises(Exception):
+        list(flat.odt.content.stream(True))
+    flat.close()
+
+
+def test_metadata(docs):
+    odt_file, fodt_file = docs
+    flat = FlatODTInputFile(fodt_file, None)
+    md = flat.get_metadata()
+    flat.close()
+    expected = ODTInputFile(odt_file, None).get_metadata()
+    assert (md.author_first, md.author_last) == (expected.author_first, expected.author_last)
+    assert md.author_last == "Doe"
+
+
+def test_close(docs):
+    odt_file, fodt_file = docs
+    flat = FlatODTInputFile(fodt_file, None)
+    flat.close()
+    flat.close()
+    assert list(flat.sections()) == []
+
+
+@pytest.mark.parametrize("image_xml", [
+    sample_docs.EMBEDDED_IMAGE_XML,
+    # Older files have no mime type.
+    sample_docs.EMBEDDED_IMAGE_XML.replace(' draw:mime-type="image/png"', ''),
+])
+def test_embedded_image(tmp_path, image_xml):
+    odt_file = str(tmp_path / "images.odt")
+    fodt_file = str(tmp_path / "images.fodt")
+    sample_docs.write_odt(odt_file, sample_docs.IMAGE_BODY)
+    sample_docs.write_fodt(fodt_file, sample_docs.IMAGE_BODY, image_xml)
+    for clean in (False, True):
+        expected = read(ODTInputFile(odt_file, None), clean)
+        for lazy_paras in (False, True):
+            flat = FlatODTInputFile(fodt_file, None, lazy_paras=lazy_paras)
+            assert read(flat, clean) == expected
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        images = find_images(FlatODTInputFile(fodt_file, None).sections())
+    assert len(images) == 2
+    for image in images:
+        assert image.filename.endswith(".png")
+        assert image.get_mimetype() == "image/png"
+        assert save(image) == sample_docs.IMAGE_DATA
+    # The same data gets the same name.
+    assert images[0].filename == images[1].filename
+
+
+def test_image_without_data_is_skipped(tmp_path):
+    fodt_file = str(tmp_path / "images.fodt")
+    sample_docs.write_fodt(fodt_file, sample_docs.IMAGE_BODY, '<draw:image/>')
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = list(FlatODTInputFile(fodt_file, None).sections())
+    assert find_images(sections) == []
+    assert len(sections) > 5
@@ -0,0 +1,74 @@
+"""
+Tests for the CorrectionJournal, filled in by the Cleaner.
+"""
+
+import contextlib
+import io
+from selfpub import text
+from selfpub.inp import Cleaner, CorrectionJournal, InputFile, load_journal
+
+
+PARAS = [
+    '\t"Hello," she said.',
+    '\tNothing to fix.',
+    "\tIt's a 'test'.",
+    '\t"One" and "two".',
+]
+
+
+class ListInput(InputFile):
+    """Paragraphs, numbered like the ODT input does."""
+    def __init__(self, vals):
+        InputFile.__init__(self)
+        self.vals = vals
+
+    def sections(self):
+        for ordinal, val in enumerate(self.vals):
+            para = text.Para()
+            para.source = text.Provenance(ordinal + 1, None, None, None)
+            span = text.Text()
+            span.text = val
+            para.add_span(span)
+            yield para
+
+
+def clean(journal):
+    cleaner = Cleaner(None, ListInput(PARAS), journal=journal)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return list(cleaner.sections())
+
+
+def test_corrections_are_journaled():
+    journal = CorrectionJournal()
+    paras = clean(journal)
+    for para in paras:
+        for span in para.spans:
+            assert not isinstance(span, text.Correction)
+    entries = journal.entries()
+    assert [e.paragraph for e in entries] == [1, 1, 3, 3, 3, 4, 4, 4, 4]
+    for entry in entries:
+        cleaned = paras[entry.paragraph - 1].get_text()
+        # The correction is at the cleaned quote that replaced it.
+        assert cleaned[entry.offset] in u"“”‘’", entry
+    assert journal.summary()["corrections"] == len(entries)
+    assert journal.summary()["paragraphs"] == 3
+
+
+def test_section_is_the_chapter_query():
+    journal = CorrectionJournal()
+    paras = clean(journal)
+    chapter = text.Chapter("Chapter", 1)
+    for para in paras[2:]:
+        chapter.add_div(para)
+    assert journal.section(chapter) == journal.paragraphs(3, 5)
+    assert len(journal.section(chapter)) == 7
+
+
+def test_file_journal(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    journal = CorrectionJournal(filename)
+    clean(journal)
+    journal.close()
+    expected = CorrectionJournal()
+    clean(expected)
+    assert load_journal(filename).entries() == expected.entries()
@@ -0,0 +1,93 @@
+"""
+Tests for the MediaWriter, and the images of the HTML output.
+"""
+
+import contextlib
+import io
+import os
+import re
+from selfpub import text
+from selfpub.outp.html import write_part
+from selfpub.outp.media import MediaWriter
+
+
+class DataImage(text.Image):
+    __slots__ = ('data',)
+
+    def __init__(self, filename, data):
+        text.Image.__init__(self, filename)
+        self.data = data
+
+    def save_as(self, dest_file_stream):
+        dest_file_stream.write(self.data)
+
+
+def read_file(directory, name):
+    with open(os.path.join(directory, name), "rb") as f:
+        return f.read()
+
+
+def list_files(directory):
+    ret = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            ret.append(os.path.relpath(os.path.join(dirpath, name), directory))
+    return sorted(ret)
+
+
+def test_identical_images_written_once(tmp_path):
+    outdir = str(tmp_path)
+    media = MediaWriter(outdir)
+    first = media.write(DataImage("Pictures/a.png", b"picture"))
+    assert media.write(DataImage("Pictures/b.png", b"picture")) == first
+    assert media.write(DataImage("Pictures/a.png", b"picture")) == first
+    assert list_files(outdir) == [os.path.join("Pictures", "a.png")]
+    assert read_file(outdir, first) == b"picture"
+    assert (media.bytes_written, media.bytes_saved) == (7, 14)
+
+
+def test_distinct_images_get_distinct_names(tmp_path):
+    outdir = str(tmp_path)
+    media = MediaWriter(outdir)
+    images = [
+        DataImage("Pictures/a.png", b"one"),
+        DataImage("Pictures/a.png", b"two"),
+        DataImage("Pictures/b.png", b"three"),
+        DataImage("Pictures/a.png", b"four"),
+    ]
+    names = [media.write(image) for image in images]
+    assert len(set(names)) == len(names)
+    assert names[0] == "Pictures/a.png"
+    for name, image in zip(names, images):
+        assert read_file(outdir, name) == image.data
+    assert len(list_files(outdir)) == len(images)
+
+
+def test_existing_file_not_written_again(tmp_path):
+    outdir = str(tmp_path)
+    MediaWriter(outdir).write(DataImage("Pictures/a.png", b"picture"))
+    media = MediaWriter(outdir)
+    assert media.write(DataImage("Pictures/a.png", b"picture")) == "Pictures/a.png"
+    assert (media.bytes_written, media.bytes_saved) == (0, 7)
+
+
+def test_html_references(tmp_path):
+    outdir = str(tmp_path)
+    para = text.Para()
+    for image in (
+            DataImage("Pictures/a.png", b"one"),
+            DataImage("Pictures/copy-of-a.png", b"one"),
+            DataImage("Pictures/b.png", b"two"),
+            DataImage("Pictures/a.png", b"three")):
+        para.add_span(image)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_part(para, out, MediaWriter(outdir))
+    sources = re.findall(r"<img src='([^']*)'>", out.getvalue())
+    assert len(sources) == 4
+    # The copy points to the file that was written; the others each have
+    # their own file.
+    assert sources[1] == sources[0]
+    assert len(set(sources)) == 3
+    assert [read_file(outdir, name) for name in sources] == [b"one", b"one", b"two", b"three"]
+    assert len(list_files(outdir)) == 3
@@ -0,0 +1,114 @@
+"""
+Tests for the ODT reader.
+"""
+
+import contextlib
+import io
+import threading
+import time
+import pytest
+from selfpub import text
+from selfpub.inp import ODTInputFile
+from selfpub.inp import zipio
+import sample_docs
+
+
+@pytest.fixture
+def odt_file(tmp_path):
+    ret = str(tmp_path / "sample.odt")
+    # Big enough that the prefetch buffers fill up.
+    sample_docs.write_odt(ret, sample_docs.SAMPLE_BODY * 3000)
+    return ret
+
+
+def prefetch_threads():
+    return [t for t in threading.enumerate() if t.name.startswith("odt-prefetch")]
+
+
+def wait_for_prefetch_threads(timeout):
+    end = time.monotonic() + timeout
+    for thread in prefetch_threads():
+        thread.join(max(0, end - time.monotonic()))
+    return prefetch_threads()
+
+
+def test_close_stops_prefetch(odt_file):
+    start = time.monotonic()
+    inp = ODTInputFile(odt_file, None, prefetch=True, use_mmap=True)
+    assert inp.get_metadata().author_last == "Doe"
+    inp.close()
+    inp.close()
+    assert wait_for_prefetch_threads(zipio.PREFETCH_IDLE_TIMEOUT / 2) == []
+    assert time.monotonic() - start < zipio.PREFETCH_IDLE_TIMEOUT
+
+
+def test_sections_stop_prefetch(odt_file):
+    inp = ODTInputFile(odt_file, None, prefetch=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        count = len(list(inp.sections()))
+    assert count > 1000
+    assert wait_for_prefetch_threads(zipio.PREFETCH_IDLE_TIMEOUT / 2) == []
+    inp.close()
+
+
+def test_close_while_reading(odt_file):
+    inp = ODTInputFile(odt_file, None, prefetch=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = inp.sections()
+        for i in range(5):
+            next(sections)
+    inp.close()
+    assert wait_for_prefetch_threads(zipio.PREFETCH_IDLE_TIMEOUT / 2) == []
+
+
+def test_images_can_be_saved_until_closed(tmp_path):
+    odt_file = str(tmp_path / "images.odt")
+    sample_docs.write_odt(odt_file, sample_docs.IMAGE_BODY)
+    inp = ODTInputFile(odt_file, None, use_mmap=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = list(inp.sections())
+    image = [sec for sec in sections if len(getattr(sec, 'divs', ())) > 0][0].divs[0]
+    out = io.BytesIO()
+    image.save_as(out)
+    assert out.getvalue() == sample_docs.IMAGE_DATA
+    inp.close()
+    with pytest.raises(Exception):
+        image.save_as(io.BytesIO())
+
+
+def describe(node):
+    """The node, and everything in it, as nested lists."""
+    ret = [type(node).__name__, node.style, node.source]
+    if isinstance(node, text.Para):
+        ret.append([describe(span) for span in node.spans])
+    elif isinstance(node, text.SideBar):
+        ret.append([describe(div) for div in node.divs])
+    elif isinstance(node, text.Image):
+        out = io.BytesIO()
+        node.save_as(out)
+        ret.extend((node.filename, out.getvalue()))
+    elif isinstance(node, text.Text):
+        ret.append(node.text)
+    return ret
+
+
+def test_parallel_same_as_serial(tmp_path):
+    odt_file = str(tmp_path / "images.odt")
+    sample_docs.write_odt(odt_file, sample_docs.IMAGE_BODY * 5)
+    parsed = []
+    for parallel in (False, True):
+        inp = ODTInputFile(odt_file, None, parallel=parallel, workers=2, chunk_size=4)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed.append([describe(sec) for sec in inp.sections()])
+        inp.close()
+    assert parsed[1] == parsed[0]
+    # In order: the image paragraphs are the 5th and the last of the body.
+    size = len(sample_docs.IMAGE_BODY)
+    assert [sec[2].paragraph for sec in parsed[0] if sec[0] == 'SideBar'] == sorted(
+        [i * size + 5 for i in range(5)] + [i * size for i in range(1, 6)])
+    assert repr(parsed[0]).count(repr(sample_docs.IMAGE_DATA)) == 10
+
+
+def test_parallel_lazy_paras(odt_file):
+    with pytest.raises(Exception):
+        ODTInputFile(odt_file, None, parallel=True, lazy_paras=True)